@@ -0,0 +1,44 @@
+"""Gunicorn settings for server.py: `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+Every value can be overridden with the matching GUNICORN_* environment variable.
+"""
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+
+# synthesis mostly waits on the network and OCR runs in tesseract
+# subprocesses, so one process per core with a handful of threads each
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# server.py divides the cores between the workers' OCR pools by this
+os.environ['GUNICORN_WORKERS'] = str(workers)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# /tts and /tts_batch synthesize long texts within the request
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# on SIGTERM, in-flight requests get this long to finish before workers are killed
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# ESP32s and the UI poll /latest.mp3; keep their connections open
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+# import server.py (DB setup, cache index) once in the master and fork workers from it;
+# each worker drops the pooled DB connections it inherits (see register_at_fork in server.py)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1').lower() in ('1', 'true', 'yes', 'on')
+
+# server.py logs one line per request itself
+accesslog = None
+errorlog = '-'
+
+# /metrics adds up the snapshots every worker writes here
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'amharic_tts_metrics'))
+
+
+def post_fork(server, worker):
+    # the DB log writer, retention, job and metrics threads run per worker;
+    # starting them here rather than in the master keeps them fork-safe
+    import server as tts_server
+    tts_server.start_background_services()
@@ -0,0 +1,318 @@
+"""OCR worker processes for server.py.
+
+server.py runs these functions in a pool of long-lived processes. With
+tesserocr installed each worker loads a language model once and reuses it for
+every image; otherwise pytesseract is used, which still starts the tesseract
+binary per call but keeps that work off the web workers. This module must stay
+free of server.py imports so that starting a worker is cheap.
+"""
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+# lang spec ('' = tesseract default) -> tesserocr.PyTessBaseAPI
+_APIS = {}
+_ENGINE = 'pytesseract'
+
+
+def init(engine, preload_langs=()):
+    """Pool initializer: pick the engine and load the models up front."""
+    global _ENGINE
+    _ENGINE = engine
+    if engine == 'tesserocr':
+        for lang in preload_langs:
+            try:
+                _api(lang)
+            except Exception:
+                # reported when the language is actually used
+                pass
+
+
+def warm():
+    """No-op task used to start the worker processes ahead of the first request."""
+    return True
+
+
+def _api(lang):
+    api = _APIS.get(lang)
+    if api is None:
+        import tesserocr
+        api = tesserocr.PyTessBaseAPI(lang=lang) if lang else tesserocr.PyTessBaseAPI()
+        _APIS[lang] = api
+    return api
+
+
+def _recognize(img, lang):
+    if _ENGINE == 'tesserocr':
+        api = _api(lang)
+        api.SetImage(img)
+        return api.GetUTF8Text()
+    import pytesseract
+    return pytesseract.image_to_string(img, lang=lang) if lang else pytesseract.image_to_string(img)
+
+
+# --- Preprocessing ---
+# Phone photos are mostly blank paper at far more pixels than tesseract needs.
+# Each step is optional (see OCR_PREPROCESS in server.py) and uses only Pillow.
+DESKEW_MAX_ANGLE = 5.0
+# whole degrees first, then refined to this step around the best one
+DESKEW_STEP = 0.25
+# rotate only when the best angle sharpens the row profile by this factor over
+# 0 degrees; blank and sparse pages score about the same at every angle
+DESKEW_MIN_GAIN = 1.05
+# side of the thumbnail used to estimate skew and the text area
+_ANALYSIS_SIZE = 600
+
+
+def _target_scale(img, max_pixels, target_dpi):
+    scale = 1.0
+    if max_pixels and img.width * img.height > max_pixels:
+        scale = (max_pixels / float(img.width * img.height)) ** 0.5
+    dpi = (img.info.get('dpi') or (0, 0))[0]
+    if target_dpi and dpi and dpi > target_dpi:
+        scale = min(scale, target_dpi / float(dpi))
+    return scale
+
+
+def _binarize(img, radius, offset):
+    """Adaptive threshold: dark where a pixel is `offset` below its local mean."""
+    from PIL import ImageChops, ImageFilter
+    local_mean = img.filter(ImageFilter.BoxBlur(radius))
+    darker = ImageChops.subtract(local_mean, img)
+    return darker.point(lambda v: 0 if v > offset else 255)
+
+
+def _skew_angle(img):
+    """Angle that makes text rows line up best (sharpest row profile), or 0."""
+    from PIL import Image, ImageOps, ImageStat
+    thumb = ImageOps.invert(img.convert('L'))
+    thumb.thumbnail((_ANALYSIS_SIZE, _ANALYSIS_SIZE))
+
+    def score(angle):
+        rotated = thumb.rotate(angle, resample=Image.BILINEAR, expand=True)
+        # one column of row means = horizontal projection profile
+        profile = rotated.resize((1, rotated.height), Image.BOX)
+        return ImageStat.Stat(profile).var[0]
+
+    # ties go to the angle closest to 0
+    def rank(angle):
+        return score(angle), -abs(angle)
+
+    limit = int(DESKEW_MAX_ANGLE)
+    best = max(range(-limit, limit + 1), key=rank)
+    fine = [best + i * DESKEW_STEP for i in range(-int(0.5 / DESKEW_STEP), int(0.5 / DESKEW_STEP) + 1)]
+    best = max(fine, key=rank)
+    if not best or score(best) <= score(0) * DESKEW_MIN_GAIN:
+        return 0
+    return best
+
+
+def _text_bbox(img, margin):
+    """Bounding box of the dark content, ignoring isolated specks."""
+    from PIL import ImageFilter, ImageOps
+    thumb = ImageOps.invert(img.convert('L'))
+    thumb.thumbnail((_ANALYSIS_SIZE, _ANALYSIS_SIZE))
+    box = thumb.filter(ImageFilter.MinFilter(3)).point(lambda v: 255 if v > 64 else 0).getbbox()
+    if not box:
+        return None
+    sx, sy = img.width / float(thumb.width), img.height / float(thumb.height)
+    left, top, right, bottom = box
+    return (max(0, int(left * sx) - margin), max(0, int(top * sy) - margin),
+            min(img.width, int(right * sx) + margin), min(img.height, int(bottom * sy) + margin))
+
+
+def preprocess(img, steps=(), max_pixels=0, target_dpi=0, binarize_radius=15, binarize_offset=10,
+               crop_margin=20, timings=None):
+    """Open (if given bytes or a file path) and prepare an image for OCR.
+
+    `steps` is any of 'exif', 'grayscale', 'downscale', 'binarize', 'deskew',
+    'crop', always applied in that order. Seconds per step are added to
+    `timings` when given.
+    """
+    from PIL import Image, ImageOps
+    timings = {} if timings is None else timings
+
+    def timed(step, fn, image):
+        t0 = time.perf_counter()
+        out = fn(image)
+        timings[step] = timings.get(step, 0.0) + time.perf_counter() - t0
+        return out
+
+    steps = set(steps)
+    t0 = time.perf_counter()
+    if isinstance(img, (bytes, bytearray, str)):
+        img = Image.open(img if isinstance(img, str) else io.BytesIO(img))
+        scale = _target_scale(img, max_pixels, target_dpi) if 'downscale' in steps else 1.0
+        if scale < 1.0 and img.format == 'JPEG':
+            # let the JPEG decoder skip detail we would throw away anyway
+            img.draft('L' if 'grayscale' in steps else 'RGB',
+                      (int(img.width * scale), int(img.height * scale)))
+        img.load()
+    timings['decode'] = time.perf_counter() - t0
+
+    if 'exif' in steps:
+        img = timed('exif', ImageOps.exif_transpose, img)
+    if 'grayscale' in steps:
+        img = timed('grayscale', lambda im: im.convert('L'), img)
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    if 'downscale' in steps:
+        def downscale(im):
+            scale = _target_scale(im, max_pixels, target_dpi)
+            if scale >= 1.0:
+                return im
+            return im.resize((max(1, int(im.width * scale)), max(1, int(im.height * scale))), Image.LANCZOS)
+        img = timed('downscale', downscale, img)
+    if 'binarize' in steps:
+        img = timed('binarize', lambda im: _binarize(im.convert('L'), binarize_radius, binarize_offset), img)
+    if 'deskew' in steps:
+        def deskew(im):
+            angle = _skew_angle(im)
+            if not angle:
+                return im
+            fill = 255 if im.mode == 'L' else (255, 255, 255)
+            return im.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
+        img = timed('deskew', deskew, img)
+    if 'crop' in steps:
+        def crop(im):
+            box = _text_bbox(im, crop_margin)
+            return im.crop(box) if box else im
+        img = timed('crop', crop, img)
+    return img
+
+
+def ocr(img, langs, preprocess_opts=None):
+    """Preprocess `img` (PIL image, encoded bytes or a file path) and recognize it.
+
+    Language specs are tried in order until one works. Returns
+    (text, attempts, error, timings): `attempts` lists (lang, outcome, seconds)
+    for metrics, `timings` maps preprocessing step -> seconds, and `error` is
+    set (with text None) when every language failed.
+    """
+    timings = {}
+    img = preprocess(img, timings=timings, **(preprocess_opts or {}))
+    return _recognize_langs(img, langs) + (timings,)
+
+
+def _recognize_langs(img, langs):
+    attempts = []
+    error = None
+    for lang in langs:
+        t0 = time.perf_counter()
+        try:
+            text = _recognize(img, lang)
+        except Exception as e:
+            attempts.append((lang or 'default', 'error', time.perf_counter() - t0))
+            error = f"{type(e).__name__}: {e}"
+            continue
+        attempts.append((lang or 'default', 'ok', time.perf_counter() - t0))
+        return (text or '').strip(), attempts, None
+    return None, attempts, error
+
+
+def load_page(path, page=0, kind='image', dpi=300):
+    """Open one page of a document file.
+
+    `kind` 'pdf' rasterizes page `page` (0-based) with pdftoppm at `dpi`;
+    otherwise `page` is the frame of a multi-frame image such as a TIFF.
+    """
+    from PIL import Image
+    if kind == 'pdf':
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'page')
+            subprocess.run([shutil.which('pdftoppm') or 'pdftoppm', '-r', str(dpi), '-f', str(page + 1),
+                            '-l', str(page + 1), '-singlefile', '-gray', '-png', path, out],
+                           check=True, capture_output=True, timeout=300)
+            img = Image.open(out + '.png')
+            img.load()
+            return img
+    img = Image.open(path)
+    if page:
+        img.seek(page)
+    img.load()
+    return img
+
+
+def ocr_page(path, page, kind, langs, preprocess_opts=None, dpi=300):
+    """Load and recognize one page of a document; returns the same tuple as ocr()."""
+    t0 = time.perf_counter()
+    img = load_page(path, page, kind, dpi)
+    load_seconds = time.perf_counter() - t0
+    text, attempts, error, timings = ocr(img, langs, preprocess_opts)
+    timings['load'] = load_seconds
+    return text, attempts, error, timings
+
+
+# --- Bands ---
+# A large page is cut into horizontal bands through the blank rows between
+# text lines, so that several workers can recognize one page. Bands are read
+# top to bottom, which suits single-column text.
+# a row is blank when its mean darkness (0-255) is at most this
+BAND_BLANK_LEVEL = 2
+
+
+def text_bands(img, max_bands, min_gap=3):
+    """Split `img` into at most `max_bands` (top, bottom) row ranges, top to bottom.
+
+    Cuts go through the middle of blank runs at least `min_gap` rows tall
+    that lie between text, as close to equal heights as the gaps allow.
+    """
+    from PIL import Image, ImageOps
+    height = img.height
+    # one column of row means = horizontal projection profile of the ink
+    profile = ImageOps.invert(img.convert('L')).resize((1, height), Image.BOX).tobytes()
+    gaps = []
+    start = None
+    seen_ink = False
+    for y, level in enumerate(profile):
+        if level > BAND_BLANK_LEVEL:
+            if start is not None and seen_ink and y - start >= min_gap:
+                gaps.append((start + y) // 2)
+            start = None
+            seen_ink = True
+        elif start is None:
+            start = y
+    if max_bands < 2 or not gaps:
+        return [(0, height)]
+    cuts = set()
+    for k in range(1, max_bands):
+        want = k * height / max_bands
+        cuts.add(min(gaps, key=lambda mid: abs(mid - want)))
+    edges = [0] + sorted(cuts) + [height]
+    return [(top, bottom) for top, bottom in zip(edges, edges[1:]) if bottom > top]
+
+
+def prepare_bands(img, langs, preprocess_opts=None, min_pixels=0, max_bands=1):
+    """Preprocess `img` and either recognize it whole or split it into bands.
+
+    Small pages, and pages without gaps to cut at, are recognized right away:
+    returns ('text', (text, attempts, error, timings)). Otherwise the
+    preprocessed page is written to a temp file for ocr_band() and this
+    returns ('bands', path, [(top, bottom)], timings); the caller removes the
+    file.
+    """
+    timings = {}
+    img = preprocess(img, timings=timings, **(preprocess_opts or {}))
+    bands = [(0, img.height)]
+    if max_bands > 1 and img.width * img.height >= min_pixels:
+        t0 = time.perf_counter()
+        bands = text_bands(img, max_bands, min_gap=max(3, img.height // 300))
+        timings['bands'] = time.perf_counter() - t0
+    if len(bands) < 2:
+        return 'text', _recognize_langs(img, langs) + (timings,)
+    fd, path = tempfile.mkstemp(prefix='ocr-band-', suffix='.ppm')
+    with os.fdopen(fd, 'wb') as fh:
+        # uncompressed, so every band task can load it quickly
+        img.save(fh, 'PPM')
+    return 'bands', path, bands, timings
+
+
+def ocr_band(path, band, langs):
+    """Recognize rows band[0]:band[1] of a page written by prepare_bands()."""
+    from PIL import Image
+    with Image.open(path) as img:
+        region = img.crop((0, band[0], img.width, band[1]))
+    return _recognize_langs(region, langs)
@@ -0,0 +1,49 @@
+"""Fill the audio cache ahead of traffic, e.g. right after a deploy.
+
+Synthesizes the most frequent and most recent texts from tts_logs, plus an
+optional phrase file, that are not cached yet. Defaults come from the
+PREWARM_* settings in .env.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+from create_tables import load_dotenv
+
+
+if __name__ == '__main__':
+    BASE = Path(__file__).parent
+    load_dotenv(str(BASE / '.env'))
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, help='most frequent texts to warm (PREWARM_TOP_N)')
+    parser.add_argument('--recent', type=int, help='most recent texts to warm (PREWARM_RECENT_N)')
+    parser.add_argument('--days', type=float, help='only count logs this recent, 0 = all (PREWARM_WINDOW_DAYS)')
+    parser.add_argument('--phrases', help='file with one text per line (PREWARM_PHRASES_FILE)')
+    parser.add_argument('--rate', type=float, help='clips per second, 0 = no pause (PREWARM_RATE)')
+    parser.add_argument('--dry-run', action='store_true', help='list the candidates without synthesizing')
+    args = parser.parse_args()
+
+    try:
+        import server
+    except Exception as e:
+        print('Failed to import server module:', e)
+        sys.exit(1)
+
+    def pick(value, default):
+        return default if value is None else value
+
+    candidates = server.prewarm_candidates(
+        top_n=pick(args.top, server.PREWARM_TOP_N),
+        recent_n=pick(args.recent, server.PREWARM_RECENT_N),
+        window_days=pick(args.days, server.PREWARM_WINDOW_DAYS),
+        phrases_file=pick(args.phrases, server.PREWARM_PHRASES_FILE))
+    if args.dry_run:
+        for text, slow in candidates:
+            cached = bool(server.AUDIO_CACHE.get(server.cache_key(text, server.TTS_LANG, slow), count=False))
+            print(f"{'cached' if cached else 'missing'}\t{'slow' if slow else 'normal'}\t{text}")
+        sys.exit(0)
+    counts = server.prewarm(candidates, rate=pick(args.rate, server.PREWARM_RATE))
+    print('Prewarm: {candidates} candidates, {cached} already cached, '
+          '{synthesized} synthesized, {failed} failed.'.format(**counts))
+    sys.exit(1 if counts['failed'] else 0)
@@ -1,19 +1,57 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Request, Response, g, has_request_context, request, send_file, jsonify
 import io
-from gtts import gTTS
+import itertools
 import os
 import uuid
-import traceback
+import zipfile
+import atexit
+import contextlib
 import urllib.parse
 import base64
 import shutil
-from datetime import datetime
+import subprocess
+import sys
+import tempfile
+import hashlib
+import importlib.util
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import ocr_worker
+
+# only used to elect a single retention sweeper per host; missing on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# gTTS needs internet access; the local backend below works without it
+try:
+    from gtts import gTTS
+    GTTS_AVAILABLE = True
+except Exception:
+    GTTS_AVAILABLE = False
 
 # Optional DB support (SQLAlchemy + PostgreSQL). If DATABASE_URL is set in env,
 # we'll connect to it. Otherwise fall back to a local sqlite file so the app
 # still runs without Postgres during development.
 try:
-    from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text
+    from sqlalchemy import create_engine, event, func, text as sql_text, and_, or_, cast, update, Column, Index, Integer, String, Boolean, DateTime, Text
+    from sqlalchemy.exc import IntegrityError
     from sqlalchemy.ext.declarative import declarative_base
     from sqlalchemy.orm import sessionmaker
     SQLALCHEMY_AVAILABLE = True
@@ -31,24 +69,372 @@ def _parse_bool(v):
     s = str(v).lower()
     return s in ('1', 'true', 'yes', 'on')
 
-# Low-level WSGI middleware to log every incoming request (even if routing fails)
-orig_wsgi = app.wsgi_app
-def _wsgi_logger(environ, start_response):
-    try:
-        m = environ.get('REQUEST_METHOD')
-        p = environ.get('PATH_INFO')
-        ct = environ.get('CONTENT_TYPE')
-        cl = environ.get('CONTENT_LENGTH')
-        print("WSGI ->", m, p, "CT=", ct, "CL=", cl)
-    except Exception:
-        pass
-    return orig_wsgi(environ, start_response)
-app.wsgi_app = _wsgi_logger
+# --- Logging ---
+# Records are formatted off the request path: handlers only enqueue them and a
+# QueueListener thread writes them out. Each request produces one summary line
+# with its id and timings; request bodies are only dumped with LOG_DEBUG_BODIES.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 'text' (key=value) or 'json' (one object per line)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_BODY_MAX = int(os.environ.get('LOG_BODY_MAX', 200))
+LOG_DEBUG_BODIES = _parse_bool(os.environ.get('LOG_DEBUG_BODIES'))
+_REDACTED_HEADERS = {'authorization', 'cookie', 'proxy-authorization', 'x-api-key'}
+
+
+def _parse_sample_rates(spec):
+    """Parse "/latest.mp3=0.1,/stats=0" into {route: rate}."""
+    rates = {}
+    for part in (spec or '').split(','):
+        if '=' in part:
+            route, rate = part.rsplit('=', 1)
+            try:
+                rates[route.strip()] = max(0.0, min(1.0, float(rate)))
+            except ValueError:
+                pass
+    return rates
+
+
+# fraction of successful request lines to keep per route; errors are always logged
+LOG_SAMPLE_RATES = _parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', ''))
+
+
+def _kv(**fields):
+    """Attach structured fields to a log call: log.info('msg', extra=_kv(a=1))."""
+    return {'fields': fields}
+
+
+def _truncate(value, limit=None):
+    limit = LOG_BODY_MAX if limit is None else limit
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value).decode('utf-8', errors='replace')
+    value = str(value)
+    return value if len(value) <= limit else f"{value[:limit]}...(+{len(value) - limit} chars)"
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = getattr(g, 'request_id', None) if has_request_context() else None
+        return True
+
+
+class _StructuredFormatter(logging.Formatter):
+    def __init__(self, as_json=False):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname.lower(),
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            fields['rid'] = record.request_id
+        fields.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            fields['exc'] = self.formatException(record.exc_info)
+        if self.as_json:
+            return json.dumps(fields, ensure_ascii=False, default=str)
+        head = f"{fields.pop('ts')} {fields.pop('level').upper():<7} {fields.pop('msg')}"
+        exc = fields.pop('exc', None)
+        line = head + ''.join(f" {k}={json.dumps(v, ensure_ascii=False, default=str)}" for k, v in fields.items())
+        return f"{line}\n{exc}" if exc else line
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # the queue never leaves this process, so the record goes as it is and
+        # the listener formats it, traceback (exc_info) and args included
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+log = logging.getLogger('amharic_tts')
+log.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+log.propagate = False
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_handler = _DroppingQueueHandler(_log_queue)
+_log_handler.addFilter(_RequestIdFilter())
+log.addHandler(_log_handler)
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(_StructuredFormatter(as_json=(LOG_FORMAT == 'json')))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+
+def _restart_log_listener():
+    # a forked worker (gunicorn --preload) inherits the queue but not the
+    # listener thread; give it a fresh queue in case a lock was held at fork
+    _log_handler.queue = _log_listener.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _log_listener._thread = None
+    _log_listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_log_listener)
+
+
+def _debug_dump_request(label):
+    """Log headers and a truncated body of the current request (opt-in only)."""
+    if not (LOG_DEBUG_BODIES and log.isEnabledFor(logging.DEBUG)):
+        return
+    headers = {k: ('<redacted>' if k.lower() in _REDACTED_HEADERS else v) for k, v in request.headers.items()}
+    log.debug(label, extra=_kv(headers=headers, body=_truncate(request.get_data(cache=True)),
+                               form=_truncate(request.form.to_dict()) if request.form else None))
+
+
+# --- Metrics ---
+# In-process counters and histograms rendered in Prometheus text format at
+# /metrics. With several worker processes, set METRICS_DIR to a directory
+# they share: each process periodically writes a snapshot there and /metrics
+# merges the snapshots of all live processes.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+METRICS_PREFIX = 'amharic_tts_'
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    """Thread-safe counters and fixed-bucket latency histograms."""
+
+    def __init__(self, buckets=_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._hists = {}
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                # one count per bucket plus +Inf, then the sum
+                h = self._hists[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h[i] += 1
+                    break
+            else:
+                h[len(self.buckets)] += 1
+            h[-1] += seconds
+
+    def snapshot(self, gauges=None):
+        """Return a JSON-serializable copy; `gauges` are per-process values summed on merge."""
+        with self._lock:
+            return {
+                'counters': [[n, list(l), v] for (n, l), v in self._counters.items()],
+                'hists': [[n, list(l), list(h)] for (n, l), h in self._hists.items()],
+                'gauges': [[n, [], v] for n, v in (gauges or {}).items()],
+            }
+
+
+METRICS = Metrics()
+METRICS.describe('http_requests_total', 'counter', 'HTTP requests by route, method and status.')
+METRICS.describe('http_request_duration_seconds', 'histogram', 'Time spent in the request handler.')
+METRICS.describe('stage_duration_seconds', 'histogram', 'Time spent per processing stage.')
+METRICS.describe('backend_duration_seconds', 'histogram', 'Upstream synthesis call latency per backend.')
+METRICS.describe('backend_errors_total', 'counter', 'Failed upstream synthesis calls per backend.')
+METRICS.describe('ocr_attempt_duration_seconds', 'histogram', 'Tesseract calls by language and outcome.')
+METRICS.describe('ocr_queue_wait_seconds', 'histogram', 'Time an image waited for a free OCR slot.')
+METRICS.describe('ocr_rejected_total', 'counter', 'Images refused because the OCR queue was full.')
+METRICS.describe('ocr_preprocess_seconds', 'histogram', 'OCR image preprocessing time per step.')
+METRICS.describe('ocr_banded_pages_total', 'counter', 'Pages split into bands for parallel OCR.')
+METRICS.describe('ocr_bands_total', 'counter', 'Bands recognized from split pages.')
+METRICS.describe('ocr_cache_hits_total', 'counter', 'OCR results served from the cache, by match mode.')
+METRICS.describe('ocr_cache_misses_total', 'counter', 'Images that had to be recognized.')
+METRICS.describe('upload_dedup_total', 'counter', 'Uploaded images that were already stored.')
+METRICS.describe('requests_in_flight', 'gauge', 'Requests currently being handled.')
+METRICS.describe('audio_dir_bytes', 'gauge', 'Bytes used by the audio directory.')
+METRICS.describe('cache_hits_total', 'counter', 'Audio cache hits.')
+METRICS.describe('hot_audio_hits_total', 'counter', 'Audio served from the in-memory hot set.')
+METRICS.describe('cache_misses_total', 'counter', 'Audio cache misses.')
+METRICS.describe('cache_hit_ratio', 'gauge', 'Audio cache hits / lookups.')
+METRICS.describe('segment_cache_hits_total', 'counter', 'Segment cache hits.')
+METRICS.describe('segment_cache_misses_total', 'counter', 'Segment cache misses.')
+METRICS.describe('tts_segments_total', 'counter', 'Text segments needed for synthesis, by source (cache or synth).')
+METRICS.describe('tts_segment_reuse_ratio', 'histogram', 'Share of each synthesis served from cached segments.')
+METRICS.describe('segment_reuse_ratio', 'gauge', 'Segments served from the segment cache / all segments.')
+METRICS.describe('db_log_dropped_total', 'counter', 'tts_logs rows dropped because the writer queue was full.')
+_in_flight = [0]
+_in_flight_lock = threading.Lock()
+
+
+def _write_metrics_snapshot(snap):
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(snap, fh)
+    os.replace(tmp, path)
+
+
+def _collect_snapshots(local):
+    """Return the snapshots of every live worker process (or just ours)."""
+    if not METRICS_DIR:
+        return [local]
+    _write_metrics_snapshot(local)
+    snaps = []
+    for entry in os.scandir(METRICS_DIR):
+        if not entry.name.endswith('.json'):
+            continue
+        pid = int(entry.name.split('.')[0]) if entry.name.split('.')[0].isdigit() else None
+        if pid and pid != os.getpid():
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                # the worker is gone; its counters go with it
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+        try:
+            with open(entry.path) as fh:
+                snaps.append(json.load(fh))
+        except Exception:
+            pass
+    return snaps
+
+
+def host_in_flight():
+    """Requests in flight in every worker process on this host.
+
+    Other processes are read from their METRICS_DIR snapshots, so their part
+    is up to METRICS_FLUSH_SECONDS old; without METRICS_DIR only this
+    process counts.
+    """
+    total = _in_flight[0]
+    if not METRICS_DIR:
+        return total
+    now = time.time()
+    for entry in os.scandir(METRICS_DIR):
+        stem = entry.name.split('.')[0]
+        if not entry.name.endswith('.json') or not stem.isdigit() or int(stem) == os.getpid():
+            continue
+        try:
+            # a worker that stopped writing has exited or is stuck
+            if now - entry.stat().st_mtime > 3 * METRICS_FLUSH_SECONDS:
+                continue
+            with open(entry.path) as fh:
+                gauges = json.load(fh).get('gauges', [])
+        except Exception:
+            continue
+        total += sum(v for name, _, v in gauges if name == 'requests_in_flight')
+    return total
+
+
+def _escape_label(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in items) + '}'
+
+
+def render_metrics(snapshots, local_gauges=None):
+    """Merge snapshots and render them in the Prometheus text format.
+
+    `local_gauges` are host-wide values (such as directory sizes) that must
+    not be summed across processes.
+    """
+    counters, gauges, hists = {}, dict(local_gauges or {}), {}
+    for snap in snapshots:
+        for name, labels, value in snap.get('counters', []):
+            key = (name, tuple(tuple(kv) for kv in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, _labels, value in snap.get('gauges', []):
+            gauges[name] = gauges.get(name, 0) + value
+        for name, labels, h in snap.get('hists', []):
+            key = (name, tuple(tuple(kv) for kv in labels))
+            acc = hists.setdefault(key, [0] * len(h))
+            for i, v in enumerate(h):
+                acc[i] += v
+    lines = []
+    seen = set()
+
+    def header(name):
+        if name not in seen:
+            seen.add(name)
+            kind, text = METRICS._help.get(name, ('untyped', name))
+            lines.append(f"# HELP {METRICS_PREFIX}{name} {text}")
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+
+    hits = sum(v for (n, _), v in counters.items() if n == 'cache_hits_total')
+    misses = sum(v for (n, _), v in counters.items() if n == 'cache_misses_total')
+    gauges['cache_hit_ratio'] = (hits / (hits + misses)) if hits + misses else 0.0
+    reused = sum(v for (n, labels), v in counters.items() if n == 'tts_segments_total' and ('source', 'cache') in labels)
+    segments = sum(v for (n, _), v in counters.items() if n == 'tts_segments_total')
+    gauges['segment_reuse_ratio'] = (reused / segments) if segments else 0.0
+    for (name, labels), value in sorted(counters.items()):
+        header(name)
+        lines.append(f"{METRICS_PREFIX}{name}{_fmt_labels(labels)} {value}")
+    for name, value in sorted(gauges.items()):
+        header(name)
+        lines.append(f"{METRICS_PREFIX}{name} {value}")
+    for (name, labels), h in sorted(hists.items()):
+        header(name)
+        cumulative = 0
+        for bound, count in zip(list(METRICS.buckets) + ['+Inf'], h[:-1]):
+            cumulative += count
+            lines.append(f"{METRICS_PREFIX}{name}_bucket{_fmt_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{METRICS_PREFIX}{name}_sum{_fmt_labels(labels)} {h[-1]}")
+        lines.append(f"{METRICS_PREFIX}{name}_count{_fmt_labels(labels)} {cumulative}")
+    return lines
+
+
+def record_timing(stage, seconds):
+    """Record how long `stage` took, for /metrics and the request log line."""
+    METRICS.observe('stage_duration_seconds', seconds, stage=stage)
+    if has_request_context():
+        timings = g.setdefault('timings', {})
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+class stage_timer:
+    """Context manager that records how long a block took as a request stage."""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_timing(self.stage, time.perf_counter() - self.t0)
+        return False
+
 
 # Check whether the system `tesseract` binary is available
 TESSERACT_CMD = shutil.which('tesseract')
-TESSERACT_AVAILABLE = bool(TESSERACT_CMD)
-print("Tesseract binary:", TESSERACT_CMD)
+# tesserocr links libtesseract directly and keeps models loaded between calls
+TESSEROCR_AVAILABLE = importlib.util.find_spec('tesserocr') is not None
+TESSERACT_AVAILABLE = bool(TESSERACT_CMD) or TESSEROCR_AVAILABLE
+log.info('tesseract binary', extra=_kv(path=TESSERACT_CMD, tesserocr=TESSEROCR_AVAILABLE))
 
 # Lightweight CORS handling without external dependency
 @app.before_request
@@ -58,23 +444,66 @@ def _handle_options():
         headers = resp.headers
         headers['Access-Control-Allow-Origin'] = '*'
         headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-        headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, OPTIONS'
         return resp
 
 
 @app.before_request
-def _log_every_request():
-    try:
-        print("--> REQUEST", request.method, request.path)
-    except Exception:
-        pass
+def _start_request_log():
+    g.request_id = (request.headers.get('X-Request-ID') or uuid.uuid4().hex[:12])[:64]
+    g.t0 = time.perf_counter()
+    with _in_flight_lock:
+        _in_flight[0] += 1
+    g.in_flight = True
+
+
+@app.teardown_request
+def _end_request(exc):
+    if g.pop('in_flight', False):
+        with _in_flight_lock:
+            _in_flight[0] -= 1
 
 
 @app.after_request
 def _add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, OPTIONS'
+    # let browser clients read the clip id and validators
+    response.headers['Access-Control-Expose-Headers'] = 'X-Audio-Id, X-OCR-Text, X-OCR-Text-Truncated, X-Request-ID, ETag'
+    return response
+
+
+@app.after_request
+def _log_request(response):
+    try:
+        rid = getattr(g, 'request_id', None)
+        if rid:
+            response.headers['X-Request-ID'] = rid
+        # unmatched paths share one label so scanners cannot blow up the series count
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        elapsed = (time.perf_counter() - g.t0) if 't0' in g else None
+        METRICS.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+        if elapsed is not None:
+            METRICS.observe('http_request_duration_seconds', elapsed, route=route, method=request.method)
+        rate = LOG_SAMPLE_RATES.get(route, 1.0)
+        if response.status_code < 500 and rate < 1.0 and random.random() >= rate:
+            return response
+        fields = {
+            'method': request.method,
+            'route': route if request.url_rule else request.path,
+            'status': response.status_code,
+            'ms': round(elapsed * 1000, 1) if elapsed is not None else None,
+            'in_bytes': request.content_length,
+            'out_bytes': response.content_length,
+        }
+        for stage, seconds in (g.get('timings') or {}).items():
+            fields[f'{stage}_ms'] = round(seconds * 1000, 1)
+        if 'segments' in g:
+            fields['segments'], fields['segments_reused'] = g.segments
+        log.info('request', extra=_kv(**fields))
+    except Exception:
+        pass
     return response
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -83,10 +512,76 @@ os.makedirs(AUDIO_DIR, exist_ok=True)
 UPLOADS_DIR = os.path.join(BASE_DIR, "uploads")
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
-# track the latest generated file for easy ESP32 fetch
-LATEST_FILE = None
+# --- Upload limits ---
+# Request bodies over UPLOAD_MAX_BYTES are refused with 413 before they are
+# read. Uploaded files above UPLOAD_SPOOL_BYTES are written to a spool file in
+# UPLOADS_DIR as they arrive (instead of being held in memory), which is later
+# linked to its final name rather than copied.
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 20 * 1024 * 1024))
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 512 * 1024))
+# images with more pixels are refused after reading only their header
+UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_PIXELS', 40_000_000))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES or None
+
+
+def upload_spool(expected_size=None):
+    """Writable file for an upload: in memory when small, else a temp file in UPLOADS_DIR."""
+    if expected_size is not None and expected_size <= UPLOAD_SPOOL_BYTES:
+        return io.BytesIO()
+    return tempfile.NamedTemporaryFile('w+b', dir=UPLOADS_DIR, prefix='.upload-', suffix='.part')
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_spool(total_content_length)
+
+
+app.request_class = UploadRequest
 
 # --- Database init ---
+# DB_PROFILE=tuned (default) applies the engine settings below; 'plain' keeps
+# the driver defaults. SQLite gets WAL journaling with synchronous=NORMAL so
+# readers do not block the log writer and commits skip most fsyncs; Postgres
+# gets a sized connection pool with pre-ping.
+DB_PROFILE = os.environ.get('DB_PROFILE', 'tuned').lower()
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL').upper()
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+if SQLITE_JOURNAL_MODE not in ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'):
+    SQLITE_JOURNAL_MODE = 'WAL'
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+
+
+def _engine_kwargs(url):
+    """create_engine() options for `url` under the selected DB_PROFILE."""
+    if url.startswith('sqlite'):
+        connect_args = {"check_same_thread": False}
+        if DB_PROFILE == 'tuned':
+            connect_args['timeout'] = DB_BUSY_TIMEOUT_MS / 1000.0
+        return {'connect_args': connect_args}
+    if DB_PROFILE == 'tuned':
+        return {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_pre_ping': True,
+            'pool_recycle': DB_POOL_RECYCLE,
+        }
+    return {}
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cur.close()
+
+
 DB_ENGINE = None
 DB_Session = None
 Base = None
@@ -100,8 +595,13 @@ if SQLALCHEMY_AVAILABLE:
         if not DATABASE_URL:
             # default to sqlite file in project folder for convenience
             DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'amharic_tts.db')}"
-        DB_ENGINE = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith('sqlite') else {})
+        DB_ENGINE = create_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL))
+        if DB_PROFILE == 'tuned' and DATABASE_URL.startswith('sqlite'):
+            event.listen(DB_ENGINE, 'connect', _sqlite_pragmas)
         DB_Session = sessionmaker(bind=DB_ENGINE)
+        # a forked worker (gunicorn --preload) must not reuse the parent's pooled
+        # connections; drop them from its pool without closing the parent's sockets
+        os.register_at_fork(after_in_child=lambda: DB_ENGINE.dispose(close=False))
 
         class TTSLog(Base):
             __tablename__ = 'tts_logs'
@@ -111,13 +611,16 @@ if SQLALCHEMY_AVAILABLE:
             # OCR-extracted text from an uploaded/captured image
             ocr_text = Column(Text, nullable=True)
             # path to saved uploaded image (if any)
-            image = Column(String(512), nullable=True)
+            image = Column(String(512), nullable=True, index=True)
             # path to generated audio file (if any)
-            audio_filename = Column(String(512), nullable=True)
+            audio_filename = Column(String(512), nullable=True, index=True)
             voice = Column(String(64), nullable=True)
             slow = Column(Boolean, default=False)
             created_at = Column(DateTime, default=datetime.utcnow)
 
+            # keyset pagination for /history walks (created_at, id) backwards
+            __table_args__ = (Index('ix_tts_logs_created_at_id', 'created_at', 'id'),)
+
         class Setting(Base):
             __tablename__ = 'settings'
             id = Column(Integer, primary_key=True)
@@ -126,432 +629,4027 @@ if SQLALCHEMY_AVAILABLE:
             created_at = Column(DateTime, default=datetime.utcnow)
             updated_at = Column(DateTime, default=datetime.utcnow)
 
+        class TTSJob(Base):
+            __tablename__ = 'tts_jobs'
+            id = Column(String(36), primary_key=True)
+            # queued -> running -> done | failed
+            status = Column(String(16), default='queued', index=True)
+            # 'text' or 'image'
+            kind = Column(String(16), default='text')
+            text = Column(Text, nullable=True)
+            image = Column(String(512), nullable=True)
+            slow = Column(Boolean, default=False)
+            segments_done = Column(Integer, default=0)
+            segments_total = Column(Integer, default=0)
+            audio_filename = Column(String(512), nullable=True)
+            error = Column(Text, nullable=True)
+            created_at = Column(DateTime, default=datetime.utcnow)
+            updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
         # create tables if not exist
         try:
             Base.metadata.create_all(DB_ENGINE)
-            print('Database initialized:', DATABASE_URL)
+            log.info('database initialized', extra=_kv(url=DB_ENGINE.url.render_as_string(hide_password=True)))
         except Exception as e:
-            print('Failed to initialize database:', e)
+            log.error('failed to initialize database', extra=_kv(error=str(e)))
     except Exception as e:
-        print('SQLAlchemy present but DB init failed:', e)
+        log.error('SQLAlchemy present but DB init failed', extra=_kv(error=str(e)))
         SQLALCHEMY_AVAILABLE = False
 
-def save_tts_log(typed_text=None, ocr_text=None, image=None, audio_filename=None, voice=None, slow=False):
-    """Save a TTS/OCR log record. Pass whichever fields are applicable."""
-    if not SQLALCHEMY_AVAILABLE:
-        return
+def _insert_tts_logs(rows):
+    """Insert prepared tts_logs rows in one transaction."""
+    sess = DB_Session()
     try:
-        sess = DB_Session()
-        rec = TTSLog(typed_text=typed_text, ocr_text=ocr_text, image=image,
-                     audio_filename=audio_filename, voice=voice, slow=bool(slow))
-        sess.add(rec)
+        sess.bulk_insert_mappings(TTSLog, rows)
         sess.commit()
+    finally:
         sess.close()
-    except Exception as e:
-        print('Failed to save TTS log:', e)
 
-def upsert_setting(key, value):
-    if not SQLALCHEMY_AVAILABLE:
+
+def _log_row(r):
+    return {'created_at': datetime.utcnow(), **r, 'slow': bool(r.get('slow'))}
+
+
+def save_tts_log(typed_text=None, ocr_text=None, image=None, audio_filename=None, voice=None, slow=False):
+    """Save a TTS/OCR log record. Pass whichever fields are applicable.
+
+    In a serving process the record is handed to the background writer and the
+    caller never waits on the database; elsewhere it is inserted directly.
+    """
+    save_tts_logs([dict(typed_text=typed_text, ocr_text=ocr_text, image=image,
+                        audio_filename=audio_filename, voice=voice, slow=slow)])
+
+def save_tts_logs(records):
+    """Save many TTS/OCR log records (dicts of save_tts_log fields)."""
+    if not SQLALCHEMY_AVAILABLE or not records:
+        return
+    rows = [_log_row(r) for r in records]
+    if DB_LOG_WRITER.submit(rows):
         return
     try:
-        sess = DB_Session()
-        existing = sess.query(Setting).filter(Setting.key == key).one_or_none()
-        now = datetime.utcnow()
-        if existing:
-            existing.value = value
-            existing.updated_at = now
-        else:
-            existing = Setting(key=key, value=value, created_at=now, updated_at=now)
-            sess.add(existing)
-        sess.commit()
-        sess.close()
+        with stage_timer('db'):
+            _insert_tts_logs(rows)
     except Exception as e:
-        print('Failed to upsert setting:', e)
+        log.error('failed to save TTS logs', extra=_kv(error=str(e), count=len(records)))
+
+def upsert_setting(key, value):
+    SETTINGS.update({key: value})
 
 def get_all_settings():
-    if not SQLALCHEMY_AVAILABLE:
-        return {}
-    try:
-        sess = DB_Session()
-        rows = sess.query(Setting).all()
-        out = {r.key: r.value for r in rows}
-        sess.close()
-        return out
-    except Exception as e:
-        print('Failed to fetch settings:', e)
-        return {}
+    return SETTINGS.all()
 
 
-@app.route("/tts", methods=["POST"])
-def text_to_speech():
-    try:
-        print("\n📥 NEW REQUEST")
+# --- Background services ---
+# Worker threads only run in a serving process, not when scripts such as
+# create_tables.py import this module. They start on the first request (or
+# explicitly from __main__), once per process.
+_BACKGROUND_SERVICES = []
+_background_pid = None
+_background_lock = threading.Lock()
 
-        print("Headers:", dict(request.headers))
-        print("Raw data:", request.data)
-        print("Form:", request.form)
-        print("JSON:", request.get_json(silent=True))
 
-        text = None
+def background_service(fn):
+    """Register `fn` to run once per serving process."""
+    _BACKGROUND_SERVICES.append(fn)
+    return fn
 
-        # 1️⃣ JSON
-        if request.is_json:
-            data = request.get_json(silent=True)
-            if data:
-                text = data.get("text")
 
-        # 2️⃣ Form-data
-        if not text and request.form:
-            text = request.form.get("text")
-            # If the client sent a raw body without '=' (e.g. curl --data-raw "..."),
-            # some parsers convert it into a form where the text becomes the key
-            # and the value is empty. Handle that case by treating a single
-            # empty-valued key as the payload.
-            if not text:
-                for k, v in request.form.items():
-                    if k and (v is None or v == ""):
-                        text = k
-                        break
+def start_background_services():
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    for fn in _BACKGROUND_SERVICES:
+        try:
+            fn()
+        except Exception as e:
+            log.exception('failed to start background service', extra=_kv(service=fn.__name__))
 
-        # 3️⃣ Raw body (ESP32 / curl)
-        # If raw bytes are present in the request body, prefer them over form-derived
-        # keys because some clients send `application/x-www-form-urlencoded` with
-        # a raw payload that Flask parses into a single empty-valued key.
-        raw = request.get_data(cache=True)
-        if raw:
-            raw_text = raw.decode("utf-8", errors="replace").strip()
-            if raw_text:
-                text = raw_text
 
-        # If Content-Type is form-urlencoded and the client sent percent-encoded
-        # data (or the form parsed badly), attempt to parse/unquote the raw body
-        # as a fallback so percent-encoded payloads are accepted automatically.
-        try:
-            ct = request.content_type or ""
-            if "application/x-www-form-urlencoded" in ct and raw:
-                s = raw.decode("latin-1")
-                if "%" in s or "+" in s:
-                    qs = urllib.parse.parse_qs(s, keep_blank_values=True, encoding="utf-8", errors="replace")
-                    if not text:
-                        if "text" in qs and qs["text"]:
-                            text = qs["text"][0]
-                        else:
-                            # If parse_qs fails to find a key-value pair, try unquoting
-                            decoded = urllib.parse.unquote_plus(s)
-                            if decoded:
-                                text = decoded
-        except Exception:
-            pass
+@app.before_request
+def _ensure_background_services():
+    if _background_pid != os.getpid():
+        start_background_services()
 
-        # If text still looks malformed (many replacement chars or question marks),
-        # try a best-effort re-decode using the raw bytes.
-        def looks_malformed(s: str) -> bool:
-            if s is None:
-                return True
-            # heuristic: many replacement or question marks suggest decoding issues
-            return s.count("\ufffd") > 0 or s.count("?") >= max(1, len(s) // 4)
 
-        if looks_malformed(text):
+# --- Database log writer ---
+# tts_logs rows are queued and inserted in batches by one background thread,
+# flushed when DB_LOG_BATCH_SIZE rows are waiting or DB_LOG_FLUSH_SECONDS
+# after the first one arrived, and drained at exit. The same thread clears
+# references to evicted cache clips, batched the same way.
+DB_LOG_QUEUE_SIZE = int(os.environ.get('DB_LOG_QUEUE_SIZE', 10000))
+DB_LOG_BATCH_SIZE = int(os.environ.get('DB_LOG_BATCH_SIZE', 200))
+DB_LOG_FLUSH_SECONDS = float(os.environ.get('DB_LOG_FLUSH_SECONDS', 1.0))
+
+
+class DBLogWriter:
+    """Bounded queue of tts_logs rows drained by a background thread."""
+
+    _STOP = object()
+    _CLEAR = object()
+
+    def __init__(self, max_queue, batch_size, flush_seconds):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self._thread = None
+        # evicted audio files whose tts_logs references still need clearing
+        self._stale = []
+        self._stale_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, name='db-log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, rows):
+        """Queue rows for insertion; returns False when the writer is not running."""
+        if not self.running:
+            return False
+        for row in rows:
             try:
-                raw = request.get_data(cache=True)
-                if raw:
-                    # Attempt 1: strict utf-8 decode of raw bytes
-                    try:
-                        attempt = raw.decode("utf-8")
-                        if attempt:
-                            text = attempt
-                    except Exception:
-                        # Attempt 2: decode as latin-1 to preserve raw bytes,
-                        # unquote_plus to handle percent-encoding, then re-decode as utf-8.
-                        try:
-                            s = raw.decode("latin-1")
-                            s = urllib.parse.unquote_plus(s)
-                            recovered = s.encode("latin-1")
-                            text = recovered.decode("utf-8")
-                        except Exception:
-                            pass
-            except Exception:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                # the response must not wait on the database; count and move on
+                self.dropped += 1
+                METRICS.inc('db_log_dropped_total')
+        return True
+
+    def clear_audio_references(self, paths):
+        """Queue clearing of tts_logs.audio_filename for removed files; False when not running."""
+        if not self.running:
+            return False
+        with self._stale_lock:
+            wake = not self._stale
+            self._stale.extend(paths)
+        if wake:
+            try:
+                self._queue.put_nowait(self._CLEAR)
+            except queue.Full:
+                # the writer clears stale paths after every row batch anyway
                 pass
+        return True
 
-        if not text:
-            return jsonify({"error": "No text to send to TTS API"}), 400
+    def _clear_stale(self):
+        with self._stale_lock:
+            paths = self._stale[:]
+            del self._stale[:]
+        if paths:
+            _null_references('audio_filename', paths)
 
-        # read slow flag from JSON/form/query
-        slow = False
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            while item is not self._STOP and item is not self._CLEAR:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            self._clear_stale()
+            if item is self._STOP:
+                return
+
+    def _write(self, batch):
         try:
-            if request.is_json:
-                data = request.get_json(silent=True) or {}
-                slow = _parse_bool(data.get('slow'))
-            if not slow and request.form:
-                slow = _parse_bool(request.form.get('slow'))
-            if not slow:
-                slow = _parse_bool(request.args.get('slow'))
-        except Exception:
-            slow = False
+            with stage_timer('db_flush'):
+                _insert_tts_logs(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            log.error('failed to write TTS logs', extra=_kv(error=str(e), count=len(batch)))
 
-        print("✅ TEXT RECEIVED:", text)
-        print("✅ TEXT REPR:", repr(text), "len:", 0 if text is None else len(text))
+    def stop(self, timeout=10.0):
+        """Flush everything queued so far and stop the thread."""
+        if not self.running:
+            return
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            log.warning('log writer queue full at shutdown', extra=_kv(pending=self._queue.qsize()))
+            return
+        self._thread.join(timeout)
 
-        filename = f"{uuid.uuid4()}.mp3"
-        filepath = os.path.join(AUDIO_DIR, filename)
+    def stats(self):
+        return {
+            'running': self.running,
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
 
-        tts = gTTS(text=text, lang="am", slow=slow)
-        tts.save(filepath)
 
-        # update latest file
-        global LATEST_FILE
-        LATEST_FILE = filepath
+DB_LOG_WRITER = DBLogWriter(DB_LOG_QUEUE_SIZE, DB_LOG_BATCH_SIZE, DB_LOG_FLUSH_SECONDS)
 
-        # save log to DB if available (record typed text and audio path)
-        try:
-            save_tts_log(typed_text=text, audio_filename=filepath, voice=('server_slow' if slow else 'server'), slow=slow)
-        except Exception:
-            pass
 
-        print("🔊 Audio saved:", filepath)
+@background_service
+def _start_db_log_writer():
+    if SQLALCHEMY_AVAILABLE:
+        DB_LOG_WRITER.start()
 
-        return send_file(filepath, mimetype="audio/mpeg")
 
-    except Exception as e:
-        print("❌ INTERNAL SERVER ERROR")
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+# --- Synthesis backends ---
+# Every route synthesizes through the backend selected by TTS_BACKEND, which
+# also records per-backend timing and error counts for /stats.
+class SynthesisBackend:
+    """Base class for engines that turn text into MP3 bytes."""
 
+    name = 'base'
 
-@app.route('/ocr_upload', methods=['POST'])
-def ocr_upload():
-    try:
-        # Accept multipart form file 'image' or JSON/base64 body
-        print("\n📥 OCR UPLOAD REQUEST")
-        print("Headers:", dict(request.headers))
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.chars = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def synthesize(self, text, slow, lang):
+        raise NotImplementedError
+
+    def run(self, text, slow, lang):
+        """Synthesize `text` and record how long it took."""
+        t0 = time.perf_counter()
         try:
-            print("Files:", list(request.files.keys()))
+            return self.synthesize(text, slow, lang)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            METRICS.inc('backend_errors_total', backend=self.name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            METRICS.observe('backend_duration_seconds', elapsed, backend=self.name)
+            with self._lock:
+                self.calls += 1
+                self.chars += len(text)
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'calls': self.calls,
+                'errors': self.errors,
+                'chars': self.chars,
+                'avg_seconds': (self.total_seconds / self.calls) if self.calls else 0.0,
+                'max_seconds': self.max_seconds,
+            }
+
+
+class GTTSBackend(SynthesisBackend):
+    """Google Translate TTS through gTTS (needs internet access)."""
+
+    name = 'gtts'
+
+    def synthesize(self, text, slow, lang):
+        if not GTTS_AVAILABLE:
+            raise RuntimeError('gTTS is not installed; install it or set TTS_BACKEND=local')
+        buf = io.BytesIO()
+        gTTS(text=text, lang=lang, slow=slow).write_to_fp(buf)
+        return buf.getvalue()
+
+
+class LocalBackend(SynthesisBackend):
+    """Deterministic offline engine for benchmarks and offline deployments.
+
+    Produces silent MPEG-2 Layer III frames (24 kHz, 32 kbps, mono, like
+    gTTS output) whose duration follows the text length, after an optional
+    artificial latency.
+    """
+
+    name = 'local'
+    # one 96-byte MPEG-2 Layer III frame (32 kbps, 24 kHz, mono); the zeroed
+    # side info and main data decode as silence
+    FRAME = b'\xff\xf3\x44\xc4' + bytes(92)
+    FRAME_SECONDS = 576 / 24000
+
+    def __init__(self, latency=0.0, chars_per_second=12.0):
+        super().__init__()
+        self.latency = latency
+        self.chars_per_second = chars_per_second
+
+    def synthesize(self, text, slow, lang):
+        if self.latency:
+            time.sleep(self.latency)
+        seconds = max(0.5, len(text) / self.chars_per_second) * (1.5 if slow else 1.0)
+        return self.FRAME * int(seconds / self.FRAME_SECONDS)
+
+
+SYNTH_BACKENDS = {
+    'gtts': GTTSBackend,
+    'local': lambda: LocalBackend(
+        latency=float(os.environ.get('TTS_LOCAL_LATENCY_MS', 0)) / 1000.0,
+        chars_per_second=float(os.environ.get('TTS_LOCAL_CHARS_PER_SEC', 12)),
+    ),
+}
+TTS_BACKEND_NAME = os.environ.get('TTS_BACKEND', 'gtts').lower()
+if TTS_BACKEND_NAME not in SYNTH_BACKENDS:
+    log.warning('unknown TTS_BACKEND, falling back to gtts', extra=_kv(backend=TTS_BACKEND_NAME))
+    TTS_BACKEND_NAME = 'gtts'
+TTS_BACKEND = SYNTH_BACKENDS[TTS_BACKEND_NAME]()
+log.info('TTS backend', extra=_kv(backend=TTS_BACKEND.name))
+
+
+# --- Audio cache ---
+# Synthesized MP3s are stored in AUDIO_DIR under a content-addressed name
+# derived from the canonicalized text, so repeated announcements are served
+# from disk instead of synthesizing again. The index survives restarts.
+TTS_LANG = 'am'
+TTS_CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+TTS_CACHE_MAX_ENTRIES = int(os.environ.get('TTS_CACHE_MAX_ENTRIES', 10000))
+# 'lru' evicts the least recently used clip, 'lfu' the least used one
+TTS_CACHE_POLICY = os.environ.get('TTS_CACHE_POLICY', 'lru').lower()
+
+# Ethiopic letters that are pronounced the same in modern Amharic. Each entry
+# maps the first syllable of a series onto the series we keep; all seven
+# vowel orders of the series are folded.
+_LOOKALIKE_SERIES = {
+    0x1210: 0x1200,  # ሐ -> ሀ
+    0x1280: 0x1200,  # ኀ -> ሀ
+    0x1220: 0x1230,  # ሠ -> ሰ
+    0x12D0: 0x12A0,  # ዐ -> አ
+}
+_CANON_TABLE = {}
+for _src, _dst in _LOOKALIKE_SERIES.items():
+    for _i in range(7):
+        _CANON_TABLE[_src + _i] = _dst + _i
+_CANON_TABLE.update({
+    0x1361: ' ',  # ፡ word space
+    0x1363: ',',  # ፣ comma
+    0x1362: '.',  # ። full stop
+})
+_WS_RE = re.compile(r'\s+')
+_SPACE_BEFORE_PUNCT_RE = re.compile(r' ([.,])')
+
+
+def canonicalize_text(text):
+    """Fold text that sounds the same onto one canonical form for cache keys."""
+    s = unicodedata.normalize('NFC', text or '')
+    # '::' is commonly typed instead of ።
+    s = s.replace('::', '\u1362').translate(_CANON_TABLE)
+    s = _WS_RE.sub(' ', s).strip()
+    return _SPACE_BEFORE_PUNCT_RE.sub(r'\1', s)
+
+
+def audio_etag(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(text, lang=TTS_LANG, slow=False):
+    # audio from different engines must not be mixed up
+    payload = f"{TTS_BACKEND.name}|{lang}|{int(bool(slow))}|{canonicalize_text(text)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AudioCache:
+    """Size-bounded MP3 cache over a directory with a JSON index on disk.
+
+    The index is rewritten after INDEX_SAVE_CHANGES puts/removals, every
+    INDEX_SAVE_SECONDS by a background thread when anything changed, and at
+    exit; clips missing from a stale index are picked up again by get().
+    Worker processes share the index file: each save merges this process's
+    entries into the one on disk under a file lock, so no worker drops the
+    clips only the others know about. File I/O never runs under the cache lock.
+    """
+
+    INDEX_SAVE_CHANGES = 100
+    INDEX_SAVE_SECONDS = 10.0
+
+    def __init__(self, directory, max_bytes, max_entries, policy='lru', persist_index=True, metric='cache'):
+        self.directory = directory
+        # without a saved index the directory is scanned on start instead
+        self.index_path = os.path.join(directory, 'cache_index.json') if persist_index else None
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.policy = policy
+        # prefix of the hit/miss counters
+        self.metric = metric
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        # key -> {'file', 'size', 'uses', 'last_used'}; ordered oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # changes since the index was last written; one writer at a time
+        self._dirty = 0
+        self._save_lock = threading.Lock()
+        # keys dropped since the last save, so the merge does not bring them back
+        self._removed = set()
+        # optional callbacks: on_store(path, size) after a put, on_remove(paths) after eviction
+        self.on_store = None
+        self.on_remove = None
+        self._load_index()
+        if persist_index:
+            atexit.register(self.save_index)
+
+    def _path(self, entry):
+        return os.path.join(self.directory, entry['file'])
+
+    def _load_index(self):
+        if self.index_path is None:
+            return self._scan()
+        try:
+            with open(self.index_path, encoding='utf-8') as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            log.warning('ignoring unreadable audio cache index', extra=_kv(error=str(e)))
+            return
+        entries = sorted(data.get('entries', {}).items(), key=lambda kv: kv[1].get('last_used', 0))
+        for key, entry in entries:
+            if os.path.exists(self._path(entry)):
+                self._entries[key] = entry
+                self.total_bytes += entry.get('size', 0)
+
+    def _scan(self):
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.mp3'):
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            found.append((st.st_mtime, entry.name, st.st_size))
+        # oldest first, as if they had last been used when written
+        for mtime, filename, size in sorted(found):
+            self._entries[filename[:-4]] = {'file': filename, 'size': size, 'uses': 0, 'last_used': mtime}
+            self.total_bytes += size
+
+    def _changed(self):
+        """Count an index change (lock held); True when the index is due to be written."""
+        self._dirty += 1
+        return self._dirty >= self.INDEX_SAVE_CHANGES
+
+    def save_index(self):
+        """Write the index if it changed, holding the cache lock only to copy it."""
+        if self.index_path is None or not self._save_lock.acquire(blocking=False):
+            # another thread is writing it; the changes stay counted for the next one
+            return
+        changes = 0
+        removed = set()
+        try:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = {key: dict(entry) for key, entry in self._entries.items()}
+                changes, self._dirty = self._dirty, 0
+                removed, self._removed = self._removed, set()
+            with _file_lock(self.index_path + '.lock'):
+                try:
+                    with open(self.index_path, encoding='utf-8') as fh:
+                        on_disk = json.load(fh).get('entries', {})
+                except (OSError, ValueError):
+                    on_disk = {}
+                for key, entry in on_disk.items():
+                    if key in removed:
+                        continue
+                    mine = snapshot.get(key)
+                    if mine is None or entry.get('last_used', 0) > mine.get('last_used', 0):
+                        snapshot[key] = entry
+                tmp = self.index_path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as fh:
+                    json.dump({'entries': snapshot}, fh)
+                os.replace(tmp, self.index_path)
+        except Exception as e:
+            with self._lock:
+                self._dirty += changes
+                self._removed |= removed - self._entries.keys()
+            log.error('failed to save audio cache index', extra=_kv(error=str(e)))
+        finally:
+            self._save_lock.release()
+
+    def get(self, key, count=True):
+        """Return the cached file path for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+        # another worker process may have evicted it, or cached it since we loaded the index
+        try:
+            size = os.path.getsize(self._path(entry) if entry else os.path.join(self.directory, f"{key}.mp3"))
+        except OSError:
+            size = None
+        with self._lock:
+            current = self._entries.get(key)
+            if size is None:
+                if current is not None and current is entry:
+                    self._drop(key)
+                    self._dirty += 1
+                    current = None
+            elif current is None:
+                current = self._adopt(key, size)
+                self._dirty += 1
+            entry = current
+            if entry is None:
+                if count:
+                    self.misses += 1
+                    METRICS.inc(f'{self.metric}_misses_total')
+                return None
+            if count:
+                self.hits += 1
+                METRICS.inc(f'{self.metric}_hits_total')
+            entry['uses'] = entry.get('uses', 0) + 1
+            entry['last_used'] = time.time()
+            self._entries.move_to_end(key)
+            return self._path(entry)
+
+    def _adopt(self, key, size):
+        filename = f"{key}.mp3"
+        entry = self._entries[key] = {'file': filename, 'size': size, 'uses': 0, 'last_used': time.time()}
+        self.total_bytes += size
+        self._removed.discard(key)
+        return entry
+
+    def put(self, key, src_path):
+        """Move a freshly synthesized file into the cache and return its path."""
+        filename = f"{key}.mp3"
+        dest = os.path.join(self.directory, filename)
+        os.replace(src_path, dest)
+        size = os.path.getsize(dest)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries[key].get('size', 0)
+            self._entries[key] = {'file': filename, 'size': size, 'uses': 1, 'last_used': time.time()}
+            self._entries.move_to_end(key)
+            self.total_bytes += size
+            self._removed.discard(key)
+            evicted = self._evict()
+            due = self._changed()
+        for path in evicted:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if due:
+            self.save_index()
+        if self.on_store:
+            self.on_store(dest, size)
+        if evicted and self.on_remove:
+            self.on_remove(evicted)
+        return dest
+
+    def forget(self, filenames):
+        """Drop index entries for files removed behind the cache's back."""
+        keys = [os.path.splitext(name)[0] for name in filenames]
+        with self._lock:
+            dropped = [k for k in keys if k in self._entries]
+            for key in dropped:
+                self._drop(key)
+            due = bool(dropped) and self._changed()
+        if due:
+            self.save_index()
+        return len(dropped)
+
+    def etag(self, key):
+        """Content hash of a cached clip, computed once and kept in the index."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            tag = entry.get('etag')
+            path = self._path(entry)
+        if tag is None:
+            with open(path, 'rb') as fh:
+                tag = audio_etag(fh.read())
+            with self._lock:
+                entry['etag'] = tag
+        return tag
+
+    def last_used_times(self):
+        """Map of cached filename -> last use timestamp."""
+        with self._lock:
+            return {e['file']: e.get('last_used', 0) for e in self._entries.values()}
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry.get('size', 0)
+        if self.index_path is not None:
+            self._removed.add(key)
+        return entry
+
+    def _victim(self):
+        if self.policy == 'lfu':
+            # least used wins; iteration order breaks ties by recency
+            return min(self._entries, key=lambda k: self._entries[k].get('uses', 0))
+        return next(iter(self._entries))
+
+    def _evict(self):
+        """Drop entries over the limits (lock held); the caller unlinks the returned paths."""
+        removed = []
+        # never evict the entry that was just inserted
+        while len(self._entries) > 1 and (self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            entry = self._drop(self._victim())
+            self.evictions += 1
+            removed.append(self._path(entry))
+        return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'policy': self.policy,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+
+AUDIO_CACHE = AudioCache(AUDIO_DIR, TTS_CACHE_MAX_BYTES, TTS_CACHE_MAX_ENTRIES, TTS_CACHE_POLICY)
+
+
+def _cache_index_loop():
+    while True:
+        time.sleep(AudioCache.INDEX_SAVE_SECONDS)
+        AUDIO_CACHE.save_index()
+
+
+@background_service
+def _start_cache_index_flush():
+    threading.Thread(target=_cache_index_loop, daemon=True).start()
+
+# Recently synthesized clips are also kept in memory so they can be sent
+# without a disk round trip while they are written out in the background, and
+# so repeated /latest.mp3 pulls never touch the disk.
+HOT_AUDIO_MAX_BYTES = int(os.environ.get('HOT_AUDIO_MAX_BYTES', 16 * 1024 * 1024))
+HOT_AUDIO_MAX_ITEM_BYTES = int(os.environ.get('HOT_AUDIO_MAX_ITEM_BYTES', 4 * 1024 * 1024))
+
+
+class HotAudio:
+    """Byte-bounded in-memory LRU of key -> MP3 bytes."""
+
+    def __init__(self, max_bytes, max_item_bytes):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        # never evicted (the current /latest clips)
+        self.pinned = set()
+        self._items = OrderedDict()
+        # keys already written (or being written) to AUDIO_CACHE
+        self._persisted = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+        if data is not None:
+            METRICS.inc('hot_audio_hits_total')
+        return data
+
+    def put(self, key, data, persisted=False):
+        if len(data) > self.max_item_bytes:
+            return
+        with self._lock:
+            if persisted:
+                self._persisted.add(key)
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old)
+            self._items[key] = data
+            self.total_bytes += len(data)
+            for victim in list(self._items):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if victim == key or victim in self.pinned:
+                    continue
+                self.total_bytes -= len(self._items.pop(victim))
+                self._persisted.discard(victim)
+
+    def claim_persist(self, key):
+        """True once for a clip that is only in memory; the caller then persists it.
+
+        Clips this set does not hold (too large, or already evicted) are not
+        remembered, so each call for them persists again; _persist_clip()
+        skips those already on disk.
+        """
+        with self._lock:
+            if key in self._persisted:
+                return False
+            if key in self._items:
+                self._persisted.add(key)
+            return True
+
+    def persist_failed(self, key):
+        with self._lock:
+            self._persisted.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._items), 'bytes': self.total_bytes,
+                    'max_bytes': self.max_bytes, 'hits': self.hits}
+
+
+HOT_AUDIO = HotAudio(HOT_AUDIO_MAX_BYTES, HOT_AUDIO_MAX_ITEM_BYTES)
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key onto one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running block until it finishes and receive the same result
+    (or the same exception).
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return (result, shared); `shared` is True for collapsed callers."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls),
+            }
+
+
+SYNTH_FLIGHTS = SingleFlight()
+
+
+# --- Segment synthesis ---
+# gTTS fetches its ~100 character chunks one after another, so long texts are
+# split at sentence boundaries and the sentences are synthesized concurrently
+# on a shared pool. The MP3 results are then stitched back together in order.
+TTS_MAX_WORKERS = int(os.environ.get('TTS_MAX_WORKERS', 8))
+TTS_SEGMENT_PARALLELISM = int(os.environ.get('TTS_SEGMENT_PARALLELISM', 4))
+# texts shorter than this are synthesized with a single upstream call
+TTS_SEGMENT_MIN_CHARS = int(os.environ.get('TTS_SEGMENT_MIN_CHARS', 200))
+
+SYNTH_POOL = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix='synth')
+
+# ። full stop, ፧ question mark, ፨ paragraph separator, ASCII ?/! and newlines
+_SENTENCE_RE = re.compile(r'[^\u1362\u1367\u1368?!\n]*(?:[\u1362\u1367\u1368?!]+|\n|$)')
+
+
+def split_sentences(text):
+    """Split text at Amharic sentence boundaries, keeping the terminators."""
+    out = []
+    for m in _SENTENCE_RE.finditer(text or ''):
+        seg = m.group(0).strip()
+        # a run of punctuation on its own carries nothing to speak
+        if seg and not all(c in '\u1362\u1367\u1368?!' for c in seg):
+            out.append(seg)
+    return out
+
+
+# --- Segment cache ---
+# A second cache tier holds audio per sentence (SEGMENT_SPLIT=phrase also cuts
+# at ፣ ፤ ፥ , and ;), keyed like whole clips, in AUDIO_DIR/segments. Texts that
+# share sentences are assembled from the cached frames and only the missing
+# segments go upstream. It has its own limits and policy (LFU by default, so
+# recurring template sentences stay) and no saved index: the directory is
+# scanned on start. SEGMENT_CACHE_MAX_ENTRIES=0 turns the tier off.
+SEGMENT_CACHE_DIR = os.path.join(AUDIO_DIR, 'segments')
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+SEGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('SEGMENT_CACHE_MAX_ENTRIES', 20000))
+SEGMENT_CACHE_POLICY = os.environ.get('SEGMENT_CACHE_POLICY', 'lfu').lower()
+SEGMENT_SPLIT = os.environ.get('SEGMENT_SPLIT', 'sentence').lower()
+
+SEGMENT_CACHE = None
+if SEGMENT_CACHE_MAX_ENTRIES > 0:
+    os.makedirs(SEGMENT_CACHE_DIR, exist_ok=True)
+    SEGMENT_CACHE = AudioCache(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES, SEGMENT_CACHE_MAX_ENTRIES,
+                               SEGMENT_CACHE_POLICY, persist_index=False, metric='segment_cache')
+
+# ፣ comma, ፤ semicolon, ፥ colon and their ASCII counterparts
+_PHRASE_RE = re.compile(r'[^\u1363\u1364\u1365,;]*(?:[\u1363\u1364\u1365,;]+|$)')
+
+
+def text_segments(text):
+    """Split `text` into the units the segment cache stores (see SEGMENT_SPLIT)."""
+    sentences = split_sentences(text)
+    if SEGMENT_SPLIT != 'phrase':
+        return sentences
+    out = []
+    for sentence in sentences:
+        for m in _PHRASE_RE.finditer(sentence):
+            seg = m.group(0).strip()
+            if seg and not all(c in '\u1363\u1364\u1365,;' for c in seg):
+                out.append(seg)
+    return out
+
+
+def _store_segment(key, data):
+    tmp_path = os.path.join(SEGMENT_CACHE_DIR, f"{uuid.uuid4()}.mp3.part")
+    try:
+        with open(tmp_path, 'wb') as fh:
+            fh.write(data)
+        SEGMENT_CACHE.put(key, tmp_path)
+    except Exception as e:
+        log.warning('failed to cache segment', extra=_kv(id=key, error=str(e)))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _cached_segment(key):
+    path = SEGMENT_CACHE.get(key) if SEGMENT_CACHE is not None else None
+    if path:
+        try:
+            with open(path, 'rb') as fh:
+                return fh.read()
+        except OSError:
+            # evicted by another worker since the lookup
+            pass
+    return None
+
+
+def _synthesize_segment(segment, slow, lang, store=True):
+    if SEGMENT_CACHE is None or not store:
+        return _synthesize_bytes(segment, slow, lang)
+    key = cache_key(segment, lang, slow)
+
+    def run():
+        data = _synthesize_bytes(segment, slow, lang)
+        _store_segment(key, data)
+        return data
+
+    # the same sentence requested twice at once goes upstream once
+    return SYNTH_FLIGHTS.do(('segment', key), run)[0]
+
+
+def _count_segments(total, reused):
+    METRICS.inc('tts_segments_total', reused, source='cache')
+    METRICS.inc('tts_segments_total', total - reused, source='synth')
+    METRICS.observe('tts_segment_reuse_ratio', reused / total)
+    if has_request_context():
+        counts = g.setdefault('segments', [0, 0])
+        counts[0] += total
+        counts[1] += reused
+
+
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),      # MPEG-2/2.5
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def mp3_frame_length(header):
+    """Return the byte length of the Layer III frame starting with `header`."""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x3
+    layer = (header[1] >> 1) & 0x3
+    bitrate_idx = header[2] >> 4
+    rate_idx = (header[2] >> 2) & 0x3
+    if version == 1 or layer != 1 or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+    padding = (header[2] >> 1) & 0x1
+    bitrate = _MP3_BITRATES[1 if version == 3 else 2][bitrate_idx] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_idx]
+    return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+
+def mp3_strip_tags(data):
+    """Return the MPEG audio frames of `data` without ID3 tags or a Xing/Info frame."""
+    start, end = 0, len(data)
+    if data[:3] == b'ID3' and end >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        start = 10 + size + (10 if data[5] & 0x10 else 0)
+    if end - start >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+    # the VBR summary frame describes one file only; drop it when stitching
+    length = mp3_frame_length(data[start:start + 4])
+    head = data[start:start + 64]
+    if length and (b'Xing' in head or b'Info' in head):
+        start += length
+    return data[start:end]
+
+
+def mp3_concat(parts):
+    """Stitch MP3 byte strings into one stream of frames."""
+    if len(parts) == 1:
+        return parts[0]
+    return b''.join(mp3_strip_tags(p) for p in parts)
+
+
+def _synthesize_bytes(text, slow, lang):
+    return TTS_BACKEND.run(text, slow, lang)
+
+
+def synthesize_segments(segments, slow=False, lang=TTS_LANG, parallelism=None, executor=None):
+    """Queue `segments` for synthesis and return one future per segment, in order.
+
+    At most `parallelism` segments of this call run on `executor` (SYNTH_POOL
+    by default) at once so one long document cannot take every worker. The call never blocks; each
+    finished segment starts the next one. Segments found in the segment cache
+    are resolved without going upstream. A text of one segment is looked up
+    but not stored: the clip cache already keeps it whole.
+    """
+    executor = executor or SYNTH_POOL
+    futures = [Future() for _ in segments]
+    pending = iter(range(len(segments)))
+    lock = threading.Lock()
+    cached = [_cached_segment(cache_key(seg, lang, slow)) for seg in segments] \
+        if SEGMENT_CACHE is not None else [None] * len(segments)
+    store = len(segments) > 1
+    if SEGMENT_CACHE is not None and segments:
+        _count_segments(len(segments), sum(data is not None for data in cached))
+
+    def start_next():
+        while True:
+            with lock:
+                i = next(pending, None)
+            if i is None:
+                return
+            out = futures[i]
+            if not out.set_running_or_notify_cancel():
+                continue
+            if cached[i] is not None:
+                out.set_result(cached[i])
+                cached[i] = None
+                continue
+
+            def done(f, out=out):
+                if f.exception() is not None:
+                    out.set_exception(f.exception())
+                else:
+                    out.set_result(f.result())
+                start_next()
+
+            try:
+                executor.submit(_synthesize_segment, segments[i], slow, lang, store).add_done_callback(done)
+            except Exception as e:
+                out.set_exception(e)
+                continue
+            return
+
+    for _ in range(min(len(segments), max(1, parallelism or TTS_SEGMENT_PARALLELISM))):
+        start_next()
+    return futures
+
+
+def synthesize_audio(text, slow=False, lang=TTS_LANG, executor=None):
+    """Synthesize `text` to MP3 bytes, in parallel per sentence for long texts.
+
+    Texts shorter than TTS_SEGMENT_MIN_CHARS take one upstream call; with the
+    segment cache on they are still looked up there whole. Segments run on
+    `executor`, SYNTH_POOL by default.
+    """
+    if len(text) < TTS_SEGMENT_MIN_CHARS:
+        segments = [text]
+    else:
+        segments = (text_segments(text) if SEGMENT_CACHE is not None else split_sentences(text)) or [text]
+    if len(segments) < 2 and SEGMENT_CACHE is None:
+        return _synthesize_bytes(text, slow, lang)
+    return mp3_concat([f.result() for f in synthesize_segments(segments, slow, lang, executor=executor)])
+
+
+def _synthesize_into_cache(key, text, slow, lang, executor=None):
+    # another flight may have filled the cache between our miss and now
+    path = AUDIO_CACHE.get(key, count=False)
+    if path:
+        return path
+    tmp_path = os.path.join(AUDIO_DIR, f"{uuid.uuid4()}.mp3.part")
+    try:
+        # a clip that is still being persisted needs no second synthesis
+        data = HOT_AUDIO.get(key) or synthesize_audio(text, slow, lang, executor)
+        with stage_timer('disk_write'):
+            with open(tmp_path, 'wb') as fh:
+                fh.write(data)
+            return AUDIO_CACHE.put(key, tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def synthesize_cached(text, slow=False, lang=TTS_LANG):
+    """Return (filepath, reused) for `text`, synthesizing only on a miss.
+
+    `reused` is True when the audio came from the cache or from an identical
+    request that was already being synthesized.
+    """
+    key = cache_key(text, lang, slow)
+    path = AUDIO_CACHE.get(key)
+    if path:
+        return path, True
+    with stage_timer('synth'):
+        return SYNTH_FLIGHTS.do(key, lambda: _synthesize_into_cache(key, text, slow, lang))
+
+
+# Clips served from memory are written to AUDIO_CACHE (and logged) here, off
+# the request path.
+TTS_PERSIST_WORKERS = int(os.environ.get('TTS_PERSIST_WORKERS', 2))
+PERSIST_POOL = ThreadPoolExecutor(max_workers=TTS_PERSIST_WORKERS, thread_name_prefix='persist')
+
+
+def _persist_clip(key, data):
+    if AUDIO_CACHE.get(key, count=False):
+        return
+    tmp_path = os.path.join(AUDIO_DIR, f"{uuid.uuid4()}.mp3.part")
+    try:
+        with open(tmp_path, 'wb') as fh:
+            fh.write(data)
+        AUDIO_CACHE.put(key, tmp_path)
+    except Exception:
+        HOT_AUDIO.persist_failed(key)
+        log.exception('failed to persist audio', extra=_kv(id=key))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _keep_clip(key, data, persist):
+    if persist and HOT_AUDIO.claim_persist(key):
+        PERSIST_POOL.submit(_persist_clip, key, data)
+
+
+def _synthesize_clip(key, text, slow, lang, persist):
+    data = HOT_AUDIO.get(key)
+    if data is None:
+        data = synthesize_audio(text, slow, lang)
+        HOT_AUDIO.put(key, data)
+    _keep_clip(key, data, persist)
+    return data
+
+
+def synthesize_clip(text, slow=False, lang=TTS_LANG, persist=True):
+    """Return (key, source, reused) for `text` without waiting on the disk.
+
+    `source` is MP3 bytes when the clip is in memory (hot, or just synthesized
+    and still being persisted in the background), otherwise the cached file's
+    path. With persist=False a fresh clip is only kept in memory.
+    """
+    key = cache_key(text, lang, slow)
+    data = HOT_AUDIO.get(key)
+    if data is not None:
+        # it may have been synthesized by an ephemeral request
+        _keep_clip(key, data, persist)
+        return key, data, True
+    path = AUDIO_CACHE.get(key)
+    if path:
+        return key, path, True
+    with stage_timer('synth'):
+        # a separate flight key: synthesize_cached flights return paths, not bytes
+        data, shared = SYNTH_FLIGHTS.do(('clip', key), lambda: _synthesize_clip(key, text, slow, lang, persist))
+    return key, data, shared
+
+
+def audio_path(key):
+    """Where AUDIO_CACHE keeps (or will keep) the clip for `key`."""
+    return os.path.join(AUDIO_DIR, f"{key}.mp3")
+
+
+# --- Latest clip ---
+# /latest.mp3 (channel "default") and /latest/<channel>.mp3 point at the most
+# recent clip made for that channel. The pointers live in a small JSON file in
+# AUDIO_DIR so every worker process sees the same clip; readers only re-read it
+# when the file was replaced. Clips made with persist=0 can only be served by
+# the worker that holds them in memory.
+LATEST_DEFAULT_CHANNEL = 'default'
+# how long /latest waits for another worker to finish writing the clip
+LATEST_WAIT_SECONDS = float(os.environ.get('LATEST_WAIT_SECONDS', 2.0))
+_CHANNEL_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Exclusive advisory lock across processes (a no-op without fcntl)."""
+    with open(path, 'a') as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class LatestStore:
+    """Per-channel {'key', 'at'} pointers kept in a JSON file shared by all workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        self._stamp = None
+
+    def _load(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self._data
+        # os.replace gives every write a new inode
+        stamp = (st.st_ino, st.st_mtime_ns)
+        if stamp != self._stamp:
+            try:
+                with open(self.path, encoding='utf-8') as fh:
+                    self._data = json.load(fh)
+                self._stamp = stamp
+            except Exception as e:
+                log.warning('ignoring unreadable latest pointer file', extra=_kv(error=str(e)))
+        return self._data
+
+    def get(self, channel=LATEST_DEFAULT_CHANNEL):
+        with self._lock:
+            return self._load().get(channel)
+
+    def all(self):
+        with self._lock:
+            return dict(self._load())
+
+    def set(self, key, channel=LATEST_DEFAULT_CHANNEL):
+        with self._lock, _file_lock(self.path + '.lock'):
+            data = dict(self._load())
+            data[channel] = {'key': key, 'at': time.time()}
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                json.dump(data, fh)
+            os.replace(tmp, self.path)
+            self._data = data
+            st = os.stat(self.path)
+            self._stamp = (st.st_ino, st.st_mtime_ns)
+        return data
+
+
+LATEST = LatestStore(os.path.join(AUDIO_DIR, 'latest.json'))
+
+
+def request_channel(data=None):
+    """Latest channel named by `?channel=`, a JSON `channel` field or X-Channel."""
+    channel = request.args.get('channel') or request.headers.get('X-Channel')
+    if not channel and isinstance(data, dict):
+        channel = data.get('channel')
+    if not channel and request.is_json:
+        body = request.get_json(silent=True)
+        channel = body.get('channel') if isinstance(body, dict) else None
+    channel = channel or LATEST_DEFAULT_CHANNEL
+    return channel if _CHANNEL_RE.match(channel) else LATEST_DEFAULT_CHANNEL
+
+
+def set_latest(key, channel=LATEST_DEFAULT_CHANNEL):
+    """Point /latest for `channel` at the clip for `key` (pinned in the hot set)."""
+    data = LATEST.set(key, channel)
+    HOT_AUDIO.pinned = {entry['key'] for entry in data.values()}
+
+
+def _store_streamed(key, text, slow, futures, lang=TTS_LANG, persist=True, channel=LATEST_DEFAULT_CHANNEL,
+                    log_fields=None):
+    """Wait for a streamed synthesis to finish and persist it like /tts does."""
+    try:
+        data = mp3_concat([f.result() for f in futures])
+    except Exception:
+        log.exception('failed to assemble streamed audio')
+        return
+    HOT_AUDIO.put(key, data, persisted=persist)
+    set_latest(key, channel)
+    if not persist:
+        return
+    _persist_clip(key, data)
+    save_tts_log(audio_filename=audio_path(key), voice=('server_slow' if slow else 'server'), slow=slow,
+                 **(log_fields or {'typed_text': text}))
+    log.info('streamed audio saved', extra=_kv(file=f"{key}.mp3"))
+
+
+def stream_synthesis(text, slow=False, lang=TTS_LANG, persist=True, channel=LATEST_DEFAULT_CHANNEL,
+                     log_fields=None):
+    """Yield MP3 frames sentence by sentence as soon as each one is ready.
+
+    The complete file is assembled and cached in the background, even when the
+    client disconnects before the stream ends. `log_fields` replaces the
+    default `typed_text` in the tts_logs row.
+    """
+    segments = (text_segments(text) if SEGMENT_CACHE is not None else split_sentences(text)) or [text]
+    futures = synthesize_segments(segments, slow, lang)
+    threading.Thread(target=_store_streamed,
+                     args=(cache_key(text, lang, slow), text, slow, futures, lang, persist, channel, log_fields),
+                     daemon=True).start()
+    for f in futures:
+        data = f.result()
+        yield mp3_strip_tags(data) if len(futures) > 1 else data
+
+
+def stream_synthesis_parts(first, more, slow=False, lang=TTS_LANG, persist=True, channel=LATEST_DEFAULT_CHANNEL,
+                           log_fields=None, text_field='typed_text'):
+    """stream_synthesis() for text that arrives in parts, e.g. OCR bands.
+
+    `first` is synthesized right away and every part `more` yields is queued
+    as soon as it arrives, while earlier audio is being sent. Once the last
+    part is in, the whole text (parts joined by newlines) is cached and
+    logged under `text_field`.
+    """
+    ready = queue.Queue()
+
+    def feed():
+        texts = []
+        futures = []
+        try:
+            for part in itertools.chain([first], more):
+                texts.append(part)
+                segments = (text_segments(part) if SEGMENT_CACHE is not None else split_sentences(part)) or [part]
+                for f in synthesize_segments(segments, slow, lang):
+                    futures.append(f)
+                    ready.put(f)
+        except Exception as e:
+            log.exception('failed to read the rest of the text')
+            failed = Future()
+            failed.set_exception(e)
+            ready.put(failed)
+            return
+        finally:
+            ready.put(None)
+        text = '\n'.join(texts)
+        _store_streamed(cache_key(text, lang, slow), text, slow, futures, lang, persist, channel,
+                        dict(log_fields or {}, **{text_field: text}))
+
+    threading.Thread(target=feed, daemon=True).start()
+    while True:
+        f = ready.get()
+        if f is None:
+            return
+        yield mp3_strip_tags(f.result())
+
+
+_audio_dir_bytes = {'value': 0, 'at': 0.0}
+
+
+def audio_dir_bytes(max_age=60.0):
+    """Size of AUDIO_DIR, rescanned at most every `max_age` seconds."""
+    if RETENTION_AUDIO.complete:
+        return RETENTION_AUDIO.total_bytes
+    now = time.time()
+    if now - _audio_dir_bytes['at'] > max_age:
+        total = 0
+        for entry in os.scandir(AUDIO_DIR):
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+        _audio_dir_bytes.update(value=total, at=now)
+    return _audio_dir_bytes['value']
+
+
+def _process_gauges():
+    return {'requests_in_flight': _in_flight[0]}
+
+
+def _metrics_flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            _write_metrics_snapshot(METRICS.snapshot(_process_gauges()))
+        except Exception as e:
+            log.warning('failed to write metrics snapshot', extra=_kv(error=str(e)))
+
+
+@background_service
+def _start_metrics_flush():
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        threading.Thread(target=_metrics_flush_loop, daemon=True).start()
+
+
+@app.route('/metrics')
+def metrics():
+    snaps = _collect_snapshots(METRICS.snapshot(_process_gauges()))
+    lines = render_metrics(snaps, {'audio_dir_bytes': audio_dir_bytes()})
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/stats')
+def stats():
+    return jsonify({
+        'backend': TTS_BACKEND.stats(),
+        'cache': AUDIO_CACHE.stats(),
+        'hot_audio': HOT_AUDIO.stats(),
+        'segment_cache': SEGMENT_CACHE.stats() if SEGMENT_CACHE is not None else None,
+        'singleflight': SYNTH_FLIGHTS.stats(),
+        'db_writer': DB_LOG_WRITER.stats(),
+        'settings': SETTINGS.stats(),
+        'ocr_cache': OCR_CACHE.stats(),
+        'ocr': {'engine': OCR_ENGINE, 'workers': OCR_WORKERS, 'langs': OCR_LANGS, 'preprocess': OCR_PREPROCESS,
+                'bands': OCR_BANDS},
+        'retention': {r.name: r.stats() for r in RETENTION_DIRS},
+        'prewarm': dict(PREWARM_LAST, enabled=PREWARM_ENABLED),
+    })
+
+
+def _wants_persist(data=None):
+    """False for ephemeral requests (`persist=0`): audio stays in memory and is not logged."""
+    value = request.args.get('persist')
+    if value is None and data is None and request.is_json:
+        data = request.get_json(silent=True)
+    if value is None and isinstance(data, dict):
+        value = data.get('persist')
+    if value is None and request.form:
+        value = request.form.get('persist')
+    return True if value is None else _parse_bool(value)
+
+
+def send_audio(source, key=None, immutable=False, last_modified=None):
+    """Send MP3 `source` (bytes from memory or a file path) as clip `key`.
+
+    The ETag is the content hash, so conditional and Range requests work.
+    Clips addressed by id never change; everything else must revalidate.
+    """
+    if isinstance(source, bytes):
+        resp = send_file(io.BytesIO(source), mimetype='audio/mpeg', conditional=True,
+                         etag=audio_etag(source), last_modified=last_modified)
+    else:
+        etag = (AUDIO_CACHE.etag(key) if key else None) or True
+        resp = send_file(source, mimetype='audio/mpeg', conditional=True, etag=etag,
+                         last_modified=last_modified)
+    if key:
+        resp.headers['X-Audio-Id'] = key
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if immutable else 'no-cache'
+    return resp
+
+
+@app.route("/tts", methods=["POST"])
+def text_to_speech():
+    try:
+        _debug_dump_request('tts request body')
+        t_decode = time.perf_counter()
+
+        text = None
+
+        # 1️⃣ JSON
+        if request.is_json:
+            data = request.get_json(silent=True)
+            if data:
+                text = data.get("text")
+
+        # 2️⃣ Form-data
+        if not text and request.form:
+            text = request.form.get("text")
+            # If the client sent a raw body without '=' (e.g. curl --data-raw "..."),
+            # some parsers convert it into a form where the text becomes the key
+            # and the value is empty. Handle that case by treating a single
+            # empty-valued key as the payload.
+            if not text:
+                for k, v in request.form.items():
+                    if k and (v is None or v == ""):
+                        text = k
+                        break
+
+        # 3️⃣ Raw body (ESP32 / curl)
+        # If raw bytes are present in the request body, prefer them over form-derived
+        # keys because some clients send `application/x-www-form-urlencoded` with
+        # a raw payload that Flask parses into a single empty-valued key.
+        raw = request.get_data(cache=True)
+        if raw:
+            raw_text = raw.decode("utf-8", errors="replace").strip()
+            if raw_text:
+                text = raw_text
+
+        # If Content-Type is form-urlencoded and the client sent percent-encoded
+        # data (or the form parsed badly), attempt to parse/unquote the raw body
+        # as a fallback so percent-encoded payloads are accepted automatically.
+        try:
+            ct = request.content_type or ""
+            if "application/x-www-form-urlencoded" in ct and raw:
+                s = raw.decode("latin-1")
+                if "%" in s or "+" in s:
+                    qs = urllib.parse.parse_qs(s, keep_blank_values=True, encoding="utf-8", errors="replace")
+                    if not text:
+                        if "text" in qs and qs["text"]:
+                            text = qs["text"][0]
+                        else:
+                            # If parse_qs fails to find a key-value pair, try unquoting
+                            decoded = urllib.parse.unquote_plus(s)
+                            if decoded:
+                                text = decoded
+        except Exception:
+            pass
+
+        # If text still looks malformed (many replacement chars or question marks),
+        # try a best-effort re-decode using the raw bytes.
+        def looks_malformed(s: str) -> bool:
+            if s is None:
+                return True
+            # heuristic: many replacement or question marks suggest decoding issues
+            return s.count("\ufffd") > 0 or s.count("?") >= max(1, len(s) // 4)
+
+        if looks_malformed(text):
+            try:
+                raw = request.get_data(cache=True)
+                if raw:
+                    # Attempt 1: strict utf-8 decode of raw bytes
+                    try:
+                        attempt = raw.decode("utf-8")
+                        if attempt:
+                            text = attempt
+                    except Exception:
+                        # Attempt 2: decode as latin-1 to preserve raw bytes,
+                        # unquote_plus to handle percent-encoding, then re-decode as utf-8.
+                        try:
+                            s = raw.decode("latin-1")
+                            s = urllib.parse.unquote_plus(s)
+                            recovered = s.encode("latin-1")
+                            text = recovered.decode("utf-8")
+                        except Exception:
+                            pass
+            except Exception:
+                pass
+
+        record_timing('decode', time.perf_counter() - t_decode)
+        if not text:
+            return jsonify({"error": "No text to send to TTS API"}), 400
+
+        # read slow flag from JSON/form/query
+        slow = False
+        try:
+            if request.is_json:
+                data = request.get_json(silent=True) or {}
+                slow = _parse_bool(data.get('slow'))
+            if not slow and request.form:
+                slow = _parse_bool(request.form.get('slow'))
+            if not slow:
+                slow = _parse_bool(request.args.get('slow'))
+        except Exception:
+            slow = False
+
+        log.debug('tts text', extra=_kv(text=_truncate(text), chars=len(text), slow=slow))
+
+        persist = _wants_persist()
+        key, source, hit = synthesize_clip(text, slow, persist=persist)
+
+        # update latest file
+        set_latest(key, request_channel())
+
+        # save log to DB if available (record typed text and audio path)
+        if persist:
+            try:
+                save_tts_log(typed_text=text, audio_filename=audio_path(key), voice=('server_slow' if slow else 'server'), slow=slow)
+            except Exception:
+                pass
+
+        log.debug('audio ready', extra=_kv(file=f"{key}.mp3", cached=hit, persist=persist))
+
+        with stage_timer('send'):
+            return send_audio(source, key)
+
+    except Exception as e:
+        log.exception('tts failed')
+        return jsonify({"error": str(e)}), 500
+
+
+# --- OCR pool ---
+# Images are recognized in long-lived worker processes (see ocr_worker.py) that
+# keep their tesseract models loaded. At most OCR_WORKERS run at once and
+# OCR_MAX_QUEUED more may wait; anything beyond that is refused with a 503.
+# OCR_LANGS is tried in order ('default' = tesseract's default language);
+# set it to e.g. `amh+eng` for a single combined pass instead of fallbacks.
+# Every web process has its own pool, so by default the cores are shared out
+# between the GUNICORN_WORKERS processes (set by gunicorn.conf.py) rather
+# than each process starting one OCR worker per core.
+WEB_PROCESSES = max(1, int(os.environ.get('GUNICORN_WORKERS', 1)))
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', max(1, (os.cpu_count() or 1) // WEB_PROCESSES)))
+OCR_MAX_QUEUED = int(os.environ.get('OCR_MAX_QUEUED', 2 * max(1, OCR_WORKERS)))
+OCR_QUEUE_TIMEOUT = float(os.environ.get('OCR_QUEUE_TIMEOUT', 10))
+OCR_LANGS = [('' if lang.strip() == 'default' else lang.strip())
+             for lang in os.environ.get('OCR_LANGS', 'amh,eng,default').split(',')]
+# 'tesserocr', 'pytesseract' or 'auto'
+OCR_ENGINE = os.environ.get('OCR_ENGINE', 'auto').lower()
+if OCR_ENGINE == 'auto':
+    OCR_ENGINE = 'tesserocr' if TESSEROCR_AVAILABLE else 'pytesseract'
+# workers are started fresh rather than forked from a threaded web worker
+OCR_START_METHOD = os.environ.get('OCR_START_METHOD') or \
+    ('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# Preprocessing runs in the OCR workers before recognition: any of exif
+# (orientation), grayscale, downscale (to OCR_MAX_PIXELS / OCR_TARGET_DPI),
+# binarize (adaptive threshold), deskew and crop (to the text area).
+OCR_PREPROCESS = [step.strip() for step in
+                  os.environ.get('OCR_PREPROCESS', 'exif,grayscale,downscale,binarize,deskew').split(',')
+                  if step.strip()]
+OCR_MAX_PIXELS = int(os.environ.get('OCR_MAX_PIXELS', 3_000_000))
+OCR_TARGET_DPI = int(os.environ.get('OCR_TARGET_DPI', 300))
+OCR_BINARIZE_RADIUS = int(os.environ.get('OCR_BINARIZE_RADIUS', 15))
+OCR_BINARIZE_OFFSET = int(os.environ.get('OCR_BINARIZE_OFFSET', 10))
+OCR_PREPROCESS_OPTS = {
+    'steps': OCR_PREPROCESS,
+    'max_pixels': OCR_MAX_PIXELS,
+    'target_dpi': OCR_TARGET_DPI,
+    'binarize_radius': OCR_BINARIZE_RADIUS,
+    'binarize_offset': OCR_BINARIZE_OFFSET,
+}
+
+# Pages of at least OCR_BAND_MIN_PIXELS (after preprocessing) are cut into up
+# to OCR_BANDS horizontal bands between text lines and the bands recognized in
+# parallel; smaller pages are not worth the extra tasks. OCR_BANDS=1 disables
+# it. A banded image still counts as one OCR slot.
+OCR_BANDS = int(os.environ.get('OCR_BANDS', max(1, OCR_WORKERS)))
+OCR_BAND_MIN_PIXELS = int(os.environ.get('OCR_BAND_MIN_PIXELS', 1_000_000))
+
+_OCR_SLOTS = threading.BoundedSemaphore(max(1, OCR_WORKERS) + OCR_MAX_QUEUED)
+_ocr_pool = {'pid': None, 'pool': None}
+_ocr_pool_lock = threading.Lock()
+_ocr_local_lock = threading.Lock()
+
+
+class OCRBusyError(Exception):
+    """The OCR queue is full."""
+
+
+def _get_ocr_pool(reset=False):
+    with _ocr_pool_lock:
+        if reset and _ocr_pool['pool'] is not None:
+            _ocr_pool['pool'].shutdown(wait=False, cancel_futures=True)
+            _ocr_pool['pid'] = None
+        if _ocr_pool['pid'] != os.getpid():
+            ctx = multiprocessing.get_context(OCR_START_METHOD)
+            _ocr_pool['pool'] = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=ctx,
+                                                    initializer=ocr_worker.init,
+                                                    initargs=(OCR_ENGINE, OCR_LANGS))
+            _ocr_pool['pid'] = os.getpid()
+        return _ocr_pool['pool']
+
+
+@background_service
+def _start_ocr_pool():
+    if not TESSERACT_AVAILABLE or OCR_WORKERS <= 0:
+        return
+    pool = _get_ocr_pool()
+    # start the workers (and load their models) before the first image arrives
+    for _ in range(OCR_WORKERS):
+        pool.submit(ocr_worker.warm)
+
+
+def _run_ocr(img):
+    if OCR_BANDS > 1 and OCR_WORKERS > 1:
+        return _run_ocr_bands(img)
+    if OCR_WORKERS <= 0:
+        # in-process fallback, one image at a time
+        with _ocr_local_lock:
+            if ocr_worker._ENGINE != OCR_ENGINE:
+                ocr_worker.init(OCR_ENGINE)
+            return ocr_worker.ocr(img, OCR_LANGS, OCR_PREPROCESS_OPTS)
+    try:
+        return _get_ocr_pool().submit(ocr_worker.ocr, img, OCR_LANGS, OCR_PREPROCESS_OPTS).result()
+    except BrokenProcessPool:
+        # a worker died (e.g. crashed in libtesseract); start a new pool once
+        log.warning('OCR pool broken; restarting it')
+        return _get_ocr_pool(reset=True).submit(ocr_worker.ocr, img, OCR_LANGS, OCR_PREPROCESS_OPTS).result()
+
+
+def _submit_ocr(fn, *args):
+    """Run `fn(*args)` on the OCR pool and return its Future (inline when OCR_WORKERS=0)."""
+    if OCR_WORKERS <= 0:
+        out = Future()
+        with _ocr_local_lock:
+            if ocr_worker._ENGINE != OCR_ENGINE:
+                ocr_worker.init(OCR_ENGINE)
+            try:
+                out.set_result(fn(*args))
+            except Exception as e:
+                out.set_exception(e)
+        return out
+    try:
+        return _get_ocr_pool().submit(fn, *args)
+    except BrokenProcessPool:
+        log.warning('OCR pool broken; restarting it')
+        return _get_ocr_pool(reset=True).submit(fn, *args)
+
+
+def _when_all_done(futures, fn):
+    """Call `fn()` once every future has finished or been cancelled."""
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def finished(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            fn()
+
+    for f in futures:
+        f.add_done_callback(finished)
+
+
+def _submit_bands(img):
+    """Preprocess `img` on the pool and queue its bands.
+
+    Returns ('text', result) for a page read whole, else ('bands', futures,
+    timings) with one future per band, top to bottom. The band file is removed
+    once every band task is done.
+    """
+    prepared = _submit_ocr(ocr_worker.prepare_bands, img, OCR_LANGS, OCR_PREPROCESS_OPTS,
+                           OCR_BAND_MIN_PIXELS, OCR_BANDS).result()
+    if prepared[0] == 'text':
+        return prepared
+    _, path, bands, timings = prepared
+
+    def remove():
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+
+    futures = []
+    try:
+        for band in bands:
+            futures.append(_submit_ocr(ocr_worker.ocr_band, path, band, OCR_LANGS))
+    finally:
+        if futures:
+            _when_all_done(futures, remove)
+        else:
+            remove()
+    METRICS.inc('ocr_banded_pages_total')
+    METRICS.inc('ocr_bands_total', len(bands))
+    return 'bands', futures, timings
+
+
+def _run_ocr_bands(img):
+    prepared = _submit_bands(img)
+    if prepared[0] == 'text':
+        return prepared[1]
+    _, futures, timings = prepared
+    results = [f.result() for f in futures]
+    texts = [text for text, _, _ in results if text]
+    attempts = [a for _, band_attempts, _ in results for a in band_attempts]
+    errors = [error for text, _, error in results if text is None]
+    if len(errors) == len(results):
+        return None, attempts, errors[0], timings
+    # a band that failed in every language is dropped rather than failing the page
+    return '\n'.join(texts), attempts, None, timings
+
+
+def _acquire_ocr_slot(timeout):
+    t0 = time.perf_counter()
+    if not _OCR_SLOTS.acquire(timeout=timeout):
+        METRICS.inc('ocr_rejected_total')
+        raise OCRBusyError('OCR queue is full')
+    METRICS.observe('ocr_queue_wait_seconds', time.perf_counter() - t0)
+
+
+def _record_ocr(attempts, timings):
+    for step, seconds in timings.items():
+        METRICS.observe('ocr_preprocess_seconds', seconds, step=step)
+    if timings:
+        record_timing('preprocess', sum(timings.values()))
+    for lang, outcome, seconds in attempts:
+        METRICS.observe('ocr_attempt_duration_seconds', seconds, lang=lang, outcome=outcome)
+
+
+def _ocr_uncached(img, timeout):
+    _acquire_ocr_slot(timeout)
+    try:
+        text, attempts, error, timings = _run_ocr(img)
+    finally:
+        _OCR_SLOTS.release()
+    _record_ocr(attempts, timings)
+    if text is None:
+        raise RuntimeError(f"OCR failed for every language: {error}")
+    return text
+
+
+# --- OCR result cache ---
+# Text recognized from an image is kept per process, keyed by the sha256 of the
+# image bytes plus everything that affects the result (engine, languages,
+# preprocessing). In `perceptual` mode a miss also looks for an earlier image
+# whose difference hash is within OCR_CACHE_PHASH_DISTANCE bits, to catch
+# re-captures of the same page; `exact` only reuses identical uploads.
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get('OCR_CACHE_MAX_ENTRIES', 5000))
+OCR_CACHE_MODE = os.environ.get('OCR_CACHE_MODE', 'exact').lower()
+# the hash has OCR_CACHE_HASH_SIZE**2 bits
+OCR_CACHE_HASH_SIZE = int(os.environ.get('OCR_CACHE_HASH_SIZE', 16))
+OCR_CACHE_PHASH_DISTANCE = int(os.environ.get('OCR_CACHE_PHASH_DISTANCE', 12))
+_OCR_PARAMS_DIGEST = hashlib.sha256(json.dumps(
+    [OCR_ENGINE, OCR_LANGS, OCR_PREPROCESS_OPTS], sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def image_dhash(data, size=OCR_CACHE_HASH_SIZE):
+    """Difference hash of encoded image bytes (or a file) as an int, or None if unreadable."""
+    from PIL import Image, ImageOps
+    try:
+        im = Image.open(data if isinstance(data, str) else io.BytesIO(data))
+        # JPEGs decode at a fraction of their size; the hash only needs a thumbnail
+        im.draft('L', (size * 8, size * 8))
+        im = ImageOps.exif_transpose(im).convert('L').resize((size + 1, size), Image.BILINEAR)
+    except Exception:
+        return None
+    px = im.tobytes()
+    bits = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+    return bits
+
+
+class OCRCache:
+    """Entry-bounded LRU of OCR results with optional near-duplicate lookup."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        # key -> (text, dhash or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        METRICS.inc('ocr_cache_hits_total', mode='exact')
+        return entry[0]
+
+    def get_similar(self, dhash, max_distance):
+        """Text of the closest cached image within `max_distance` bits (same parameters)."""
+        suffix = '|' + _OCR_PARAMS_DIGEST
+        with self._lock:
+            best, best_distance = None, max_distance + 1
+            for key, (text, other) in self._entries.items():
+                if other is None or not key.endswith(suffix):
+                    continue
+                distance = (dhash ^ other).bit_count()
+                if distance < best_distance:
+                    best, best_distance = key, distance
+            if best is None:
+                return None
+            self._entries.move_to_end(best)
+            self.near_hits += 1
+            text = self._entries[best][0]
+        METRICS.inc('ocr_cache_hits_total', mode='perceptual')
+        return text
+
+    def put(self, key, text, dhash=None):
+        with self._lock:
+            self._entries[key] = (text, dhash)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+        METRICS.inc('ocr_cache_misses_total')
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'mode': OCR_CACHE_MODE,
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+                'hit_ratio': ((self.hits + self.near_hits) / lookups) if lookups else 0.0,
+            }
+
+
+OCR_CACHE = OCRCache(OCR_CACHE_MAX_ENTRIES)
+OCR_FLIGHTS = SingleFlight()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ocr_image(img, timeout=OCR_QUEUE_TIMEOUT, digest=None):
+    """Return the text tesseract finds in an image (PIL image, encoded bytes or file path).
+
+    Passing the encoded bytes or a path is cheaper: the worker decodes them,
+    at reduced size for large JPEGs, and the result is cached by content.
+    `digest` is the sha256 of the bytes when the caller already has it.
+
+    Waits up to `timeout` seconds (None = forever) for an OCR slot and raises
+    OCRBusyError if none frees up.
+    """
+    key, dhash, text = _ocr_cache_lookup(img, digest)
+    if key is None:
+        return _ocr_uncached(img, timeout)
+    if text is not None:
+        return text
+    # identical images arriving together are recognized once
+    text, shared = OCR_FLIGHTS.do(key, lambda: _ocr_uncached(img, timeout))
+    if not shared:
+        OCR_CACHE.put(key, text, dhash)
+    return text
+
+
+def _ocr_cache_lookup(img, digest=None):
+    """(cache key, dhash, cached text or None); the key is None for images that are not cached."""
+    if not isinstance(img, (bytes, bytearray, str)) or OCR_CACHE_MAX_ENTRIES <= 0:
+        return None, None, None
+    if digest is None:
+        digest = file_sha256(img) if isinstance(img, str) else hashlib.sha256(img).hexdigest()
+    key = f"{digest}|{_OCR_PARAMS_DIGEST}"
+    text = OCR_CACHE.get(key)
+    if text is not None:
+        return key, None, text
+    dhash = None
+    if OCR_CACHE_MODE == 'perceptual':
+        with stage_timer('dhash'):
+            dhash = image_dhash(img)
+        if dhash is not None:
+            text = OCR_CACHE.get_similar(dhash, OCR_CACHE_PHASH_DISTANCE)
+            if text is not None:
+                OCR_CACHE.put(key, text, dhash)
+                return key, dhash, text
+    OCR_CACHE.miss()
+    return key, dhash, None
+
+
+def ocr_image_parts(img, timeout=OCR_QUEUE_TIMEOUT, digest=None):
+    """Like ocr_image(), but return as soon as the top band of a banded page is read.
+
+    Returns (text, more): `more` is None when `text` is the whole text;
+    otherwise it yields the text of each later band, top to bottom, as it is
+    recognized, and the whole text is cached after the last one.
+    """
+    if OCR_BANDS < 2 or OCR_WORKERS < 2:
+        return ocr_image(img, timeout, digest), None
+    key, dhash, text = _ocr_cache_lookup(img, digest)
+    if text is not None:
+        return text, None
+    _acquire_ocr_slot(timeout)
+    try:
+        prepared = _submit_bands(img)
+    except BaseException:
+        _OCR_SLOTS.release()
+        raise
+    if prepared[0] == 'text':
+        _OCR_SLOTS.release()
+        text, attempts, error, timings = prepared[1]
+        _record_ocr(attempts, timings)
+        if text is None:
+            raise RuntimeError(f"OCR failed for every language: {error}")
+        if key is not None:
+            OCR_CACHE.put(key, text, dhash)
+        return text, None
+    _, futures, timings = prepared
+    # the page holds its slot until its last band is read, as in ocr_image()
+    _when_all_done(futures, _OCR_SLOTS.release)
+    _record_ocr([], timings)
+    texts = []
+    errors = []
+
+    def read(f):
+        text, attempts, error = f.result()
+        _record_ocr(attempts, {})
+        if text is None:
+            # a band that failed in every language is dropped, as in _run_ocr_bands()
+            errors.append(error)
+        elif text:
+            texts.append(text)
+            return text
+        return None
+
+    def finish():
+        if len(errors) == len(futures):
+            raise RuntimeError(f"OCR failed for every language: {errors[0]}")
+        text = '\n'.join(texts)
+        if key is not None:
+            OCR_CACHE.put(key, text, dhash)
+        return text
+
+    bands = iter(futures)
+    try:
+        for f in bands:
+            if read(f):
+                break
+        else:
+            return finish(), None
+    except BaseException:
+        for f in futures:
+            f.cancel()
+        raise
+
+    def more():
+        try:
+            for f in bands:
+                text = read(f)
+                if text:
+                    yield text
+            finish()
+        finally:
+            for f in futures:
+                f.cancel()
+
+    return texts[0], more()
+
+
+_UPLOAD_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'BMP': 'bmp', 'TIFF': 'tif', 'WEBP': 'webp',
+                      'PDF': 'pdf'}
+
+
+class ImageUpload:
+    """An uploaded image held in memory or in a spool file (see upload_spool).
+
+    `source` is what ocr_image() takes: the bytes, or the spool file's path so
+    the OCR worker reads it from disk.
+    """
+
+    def __init__(self, fh):
+        self._fh = fh
+        name = getattr(fh, 'name', None)
+        self.path = name if isinstance(name, str) else None
+        fh.flush()
+        fh.seek(0)
+        digest = hashlib.sha256()
+        self.size = 0
+        for chunk in iter(lambda: fh.read(UPLOAD_CHUNK_BYTES), b''):
+            digest.update(chunk)
+            self.size += len(chunk)
+        self.digest = digest.hexdigest()
+        self.format = None
+        self.pixels = 0
+        self.pages = 1
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(io.BytesIO(data))
+
+    @property
+    def source(self):
+        return self.path or self._fh.getvalue()
+
+    def inspect(self):
+        """Read the header (format, size, TIFF frames); raises if it is neither an image nor a PDF."""
+        from PIL import Image
+        self._fh.seek(0)
+        if self._fh.read(5) == b'%PDF-':
+            # pages are counted by pdf_page_count() once the file is stored
+            self.format = 'PDF'
+            return
+        self._fh.seek(0)
+        with Image.open(self._fh) as im:
+            self.format = im.format
+            self.pixels = im.width * im.height
+            if im.format == 'TIFF':
+                self.pages = getattr(im, 'n_frames', 1)
+
+    def save(self):
+        """Store the image as UPLOADS_DIR/<sha256>.<ext> and return the path (None on failure).
+
+        A spool file is hard-linked into place; an image that was uploaded
+        before is not stored again.
+        """
+        try:
+            if self.format is None:
+                with contextlib.suppress(Exception):
+                    self.inspect()
+            image_path = os.path.join(UPLOADS_DIR, f"{self.digest}.{_UPLOAD_EXTENSIONS.get(self.format, 'bin')}")
+            if os.path.exists(image_path):
+                # counts as a fresh use for retention
+                os.utime(image_path)
+                METRICS.inc('upload_dedup_total')
+            else:
+                stored = False
+                if self.path:
+                    try:
+                        os.link(self.path, image_path)
+                        stored = True
+                    except FileExistsError:
+                        stored = True
+                    except OSError:
+                        pass
+                if not stored:
+                    tmp_path = f"{image_path}.{uuid.uuid4().hex}.part"
+                    self._fh.seek(0)
+                    with open(tmp_path, 'wb') as out:
+                        shutil.copyfileobj(self._fh, out, UPLOAD_CHUNK_BYTES)
+                    os.replace(tmp_path, image_path)
+            RETENTION_UPLOADS.track(image_path, self.size)
+            return image_path
+        except Exception:
+            return None
+
+    def close(self):
+        # removes a spool file; a saved image keeps its own link
+        self._fh.close()
+
+
+# characters that are not part of standard base64; url-safe input is translated first
+_B64_STRIP_RE = re.compile(rb'[^A-Za-z0-9+/]')
+_B64_URLSAFE = bytes.maketrans(b'-_', b'+/')
+
+
+class Base64Spooler:
+    """Decode base64 text fed in arbitrary pieces into a binary file.
+
+    Whitespace, padding and a leading `data:...;base64,` prefix are ignored.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self._head = b''
+        self._tail = b''
+
+    def feed(self, chunk):
+        if self._head is None:
+            self._decode(chunk)
+            return
+        # hold back the start until a data URL prefix could be recognized
+        self._head += chunk
+        if len(self._head) >= 64 or b',' in self._head:
+            self._decode(self._take_head())
+
+    def finish(self):
+        if self._head is not None:
+            self._decode(self._take_head())
+        if len(self._tail) > 1:
+            self.out.write(base64.b64decode(self._tail + b'=' * (-len(self._tail) % 4)))
+        self._tail = b''
+
+    def _take_head(self):
+        head, self._head = self._head, None
+        if head.lstrip().startswith(b'data:') and b',' in head:
+            head = head.split(b',', 1)[1]
+        return head
+
+    def _decode(self, chunk):
+        data = self._tail + _B64_STRIP_RE.sub(b'', chunk.translate(_B64_URLSAFE))
+        cut = len(data) - len(data) % 4
+        if cut:
+            self.out.write(base64.b64decode(data[:cut]))
+        self._tail = data[cut:]
+
+
+_JSON_B64_RE = re.compile(rb'"b64"\s*:\s*"')
+
+
+def _spool_json_b64(stream, spooler):
+    """Read a JSON body, decoding its "b64" string through `spooler` as it arrives.
+
+    Returns the rest of the document parsed, with "b64" emptied, or None when
+    it is not valid JSON.
+    """
+    rest = bytearray()
+    state = 'before'
+    escape = False
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_BYTES), b''):
+        while chunk:
+            if state != 'inside':
+                rest += chunk
+                chunk = b''
+                if state == 'before':
+                    m = _JSON_B64_RE.search(rest)
+                    if m:
+                        chunk = bytes(rest[m.end():])
+                        del rest[m.end():]
+                        state = 'inside'
+                continue
+            if escape:
+                # base64 never needs escaping; a JSON encoder may still write \/ or \n
+                if chunk[:1] == b'/':
+                    spooler.feed(b'/')
+                chunk = chunk[1:]
+                escape = False
+                continue
+            quote = chunk.find(b'"')
+            backslash = chunk.find(b'\\')
+            if backslash != -1 and (quote == -1 or backslash < quote):
+                spooler.feed(chunk[:backslash])
+                chunk = chunk[backslash + 1:]
+                escape = True
+            elif quote != -1:
+                spooler.feed(chunk[:quote])
+                chunk = chunk[quote:]
+                state = 'after'
+            else:
+                spooler.feed(chunk)
+                chunk = b''
+    spooler.finish()
+    try:
+        data = json.loads(bytes(rest))
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _request_image():
+    """Read the uploaded image of an OCR request without buffering it whole.
+
+    Accepts a multipart file field `image`, a JSON body with `b64`, or a raw
+    base64 body. Returns (ImageUpload, other fields, None), or
+    (None, None, error response) when OCR is unavailable or the image is
+    missing, unreadable or too large. The caller closes the upload.
+    """
+    if not TESSERACT_AVAILABLE:
+        return None, None, (jsonify({'error': 'Tesseract OCR binary not found on server. Install tesseract (system package) and restart the server.'}), 503)
+    upload = None
+    fields = {}
+    try:
+        log.debug('ocr upload', extra=_kv(files=list(request.files.keys()), content_length=request.content_length))
+        if request.files and 'image' in request.files:
+            # already spooled by UploadRequest while the form was parsed
+            upload = ImageUpload(request.files['image'].stream)
+            fields = request.form.to_dict()
+        elif request.content_length != 0 and not request.form:
+            # base64 decodes to 3/4 of its length
+            length = request.content_length
+            spool = upload_spool(length * 3 // 4 if length is not None else None)
+            spooler = Base64Spooler(spool)
+            try:
+                if request.is_json:
+                    fields = _spool_json_b64(request.stream, spooler)
+                else:
+                    for chunk in iter(lambda: request.stream.read(UPLOAD_CHUNK_BYTES), b''):
+                        spooler.feed(chunk)
+                    spooler.finish()
+            except RequestEntityTooLarge:
+                spool.close()
+                raise
+            except Exception as e:
+                spool.close()
+                return None, None, (jsonify({'error': 'Failed to decode base64 image: ' + str(e)}), 400)
+            if fields is None:
+                spool.close()
+                return None, None, (jsonify({'error': 'Invalid JSON body'}), 400)
+            upload = ImageUpload(spool)
+    except RequestEntityTooLarge:
+        return None, None, (jsonify({'error': f'Upload too large (over {UPLOAD_MAX_BYTES} bytes)'}), 413)
+
+    error = _check_image(upload)
+    if error:
+        return None, None, error
+    return upload, fields, None
+
+
+def _check_image(upload):
+    """Error response for an upload OCR cannot take (closing it), else None.
+
+    Refuses missing or empty uploads, unreadable images, PDFs and images over
+    UPLOAD_MAX_PIXELS; only the header is read.
+    """
+    if upload is None or not upload.size:
+        if upload is not None:
+            upload.close()
+        return jsonify({'error': 'No image provided (field "image" or JSON {"b64":"..."})'}), 400
+
+    try:
+        from PIL import Image  # noqa: F401
+        if OCR_ENGINE == 'pytesseract':
+            import pytesseract  # noqa: F401
+    except Exception as e:
+        upload.close()
+        return jsonify({'error': 'Server OCR not available. Install Pillow and pytesseract with system Tesseract. ' + str(e)}), 500
+
+    try:
+        # only reads the header; the OCR worker decodes the pixels
+        upload.inspect()
+    except Exception as e:
+        upload.close()
+        return jsonify({'error': 'Failed to parse image: ' + str(e)}), 400
+    if upload.format == 'PDF':
+        upload.close()
+        return jsonify({'error': 'PDFs are read by /ocr_document'}), 400
+    if UPLOAD_MAX_PIXELS and upload.pixels > UPLOAD_MAX_PIXELS:
+        upload.close()
+        return jsonify({'error': f'Image too large (over {UPLOAD_MAX_PIXELS} pixels)'}), 413
+    return None
+
+
+@app.route('/ocr_upload', methods=['POST'])
+def ocr_upload():
+    try:
+        upload, _, error = _request_image()
+        if error:
+            return error
+
+        try:
+            with stage_timer('ocr'):
+                text = ocr_image(upload.source, digest=upload.digest)
+            # save uploaded image to `uploads/` and optionally log OCR results
+            image_path = upload.save()
+        except OCRBusyError:
+            return jsonify({'error': 'OCR is busy, try again shortly'}), 503, {'Retry-After': '5'}
+        finally:
+            upload.close()
+
+        try:
+            if SQLALCHEMY_AVAILABLE:
+                save_tts_log(ocr_text=text, image=image_path, audio_filename=None, voice='ocr', slow=False)
         except Exception:
             pass
-        print("Content-Length:", request.content_length)
+        return jsonify({'text': text})
+    except Exception as e:
+        log.exception('ocr_upload failed')
+        return jsonify({'error': str(e)}), 500
+
+
+# recognized text is echoed in a header; proxies commonly cap headers at 4-8 KB
+OCR_TEXT_HEADER_MAX = int(os.environ.get('OCR_TEXT_HEADER_MAX', 4000))
+
+
+@app.route('/ocr_tts', methods=['POST'])
+@app.route('/upload', methods=['POST'])
+def ocr_to_speech():
+    """Recognize an uploaded image and stream the text as MP3 in one request.
+
+    Takes the image like /ocr_upload plus `slow`, `persist` and `channel`
+    (query string or form/JSON fields). The recognized text comes back
+    percent-encoded in X-OCR-Text, and one tts_logs row records the image,
+    its text and the audio. A page read in bands is spoken from its top band
+    on while the others are still being recognized; X-OCR-Text then holds
+    only the text read so far and X-OCR-Text-Truncated is set.
+    """
+    try:
+        upload, data, error = _request_image()
+        if error:
+            return error
+        slow = _parse_bool(request.args.get('slow')) or _parse_bool(data.get('slow'))
+        persist = _wants_persist(data)
+
+        try:
+            with stage_timer('ocr'):
+                text, more = ocr_image_parts(upload.source, digest=upload.digest)
+            image_path = upload.save()
+        except OCRBusyError:
+            return jsonify({'error': 'OCR is busy, try again shortly'}), 503, {'Retry-After': '5'}
+        finally:
+            upload.close()
+        if not text:
+            if persist:
+                save_tts_log(ocr_text=text, image=image_path, voice='ocr', slow=False)
+            return jsonify({'error': 'No text found in image', 'text': ''}), 422
+
+        if more is None:
+            resp = speech_response(text, slow, persist, request_channel(data),
+                                   log_fields={'ocr_text': text, 'image': image_path})
+        else:
+            chunks = stream_synthesis_parts(text, more, slow, persist=persist, channel=request_channel(data),
+                                            log_fields={'image': image_path}, text_field='ocr_text')
+            # wait for the first sentence here so upstream failures still get a 500
+            first = next(chunks)
+            resp = Response(itertools.chain([first], chunks), mimetype="audio/mpeg")
+            resp.headers['Cache-Control'] = 'no-store'
+            resp.headers['X-Accel-Buffering'] = 'no'
+            resp.headers['X-OCR-Text-Truncated'] = '1'
+        quoted = urllib.parse.quote(text, safe='')
+        if len(quoted) > OCR_TEXT_HEADER_MAX:
+            # each byte quotes to at most 3 characters; drop any split character
+            head = text.encode('utf-8')[:OCR_TEXT_HEADER_MAX // 3].decode('utf-8', errors='ignore')
+            quoted = urllib.parse.quote(head, safe='')
+            resp.headers['X-OCR-Text-Truncated'] = '1'
+        resp.headers['X-OCR-Text'] = quoted
+        return resp
+    except Exception as e:
+        log.exception('ocr_tts failed')
+        return jsonify({'error': str(e)}), 500
+
+
+# --- Documents ---
+# /ocr_document reads multi-page PDFs, multi-frame TIFFs and several images in
+# one request. Every page is a separate task on the OCR pool (PDF pages are
+# rasterized there, by poppler's pdftoppm), at most OCR_DOCUMENT_INFLIGHT per
+# request at a time, so memory depends on the pages in flight and not on the
+# length of the document.
+OCR_DOCUMENT_MAX_PAGES = int(os.environ.get('OCR_DOCUMENT_MAX_PAGES', 200))
+OCR_DOCUMENT_INFLIGHT = int(os.environ.get('OCR_DOCUMENT_INFLIGHT', 2 * max(1, OCR_WORKERS)))
+OCR_PDF_DPI = int(os.environ.get('OCR_PDF_DPI', 300))
+PDFTOPPM_CMD = shutil.which('pdftoppm')
+PDFINFO_CMD = shutil.which('pdfinfo')
+
+METRICS.describe('ocr_pages_total', 'counter', 'Document pages recognized, by outcome.')
+
+
+def pdf_page_count(path):
+    """Number of pages in a PDF, from pdfinfo."""
+    out = subprocess.run([PDFINFO_CMD, path], capture_output=True, text=True, timeout=60, check=True).stdout
+    m = re.search(r'^Pages:\s+(\d+)', out, re.M)
+    if not m:
+        raise ValueError('pdfinfo reported no page count')
+    return int(m.group(1))
+
+
+def ocr_pages(pages, timeout=OCR_QUEUE_TIMEOUT):
+    """Recognize document pages in parallel, yielding (index, text, error) in page order.
+
+    `pages` is a list of (path, page, kind, cache key). The first OCR slot is
+    waited for up to `timeout` seconds (OCRBusyError after that); later pages
+    wait for slots as earlier ones finish. Cached pages skip the pool.
+    """
+    pending = deque()
+    queued = iter(enumerate(pages))
+    wait = [timeout]
+
+    def release(_):
+        _OCR_SLOTS.release()
+
+    def fill():
+        while len(pending) < max(1, OCR_DOCUMENT_INFLIGHT):
+            item = next(queued, None)
+            if item is None:
+                return
+            i, (path, page, kind, key) = item
+            text = OCR_CACHE.get(key)
+            if text is not None:
+                done = Future()
+                done.set_result((text, [], None, {}))
+                pending.append((i, key, done, True))
+                continue
+            OCR_CACHE.miss()
+            _acquire_ocr_slot(wait[0])
+            wait[0] = None
+            try:
+                future = _submit_ocr(ocr_worker.ocr_page, path, page, kind, OCR_LANGS, OCR_PREPROCESS_OPTS,
+                                     OCR_PDF_DPI)
+            except Exception:
+                _OCR_SLOTS.release()
+                raise
+            future.add_done_callback(release)
+            pending.append((i, key, future, False))
+
+    fill()
+    try:
+        while pending:
+            i, key, future, cached = pending.popleft()
+            try:
+                text, attempts, error, timings = future.result()
+            except Exception as e:
+                text, attempts, error, timings = None, [], f"{type(e).__name__}: {e}", {}
+            if not cached:
+                _record_ocr(attempts, timings)
+                if text is not None:
+                    OCR_CACHE.put(key, text)
+            METRICS.inc('ocr_pages_total', outcome='ok' if text is not None else 'error')
+            yield i, text, error
+            fill()
+    finally:
+        # the client went away: drop pages that have not started
+        for _, _, future, _ in pending:
+            future.cancel()
+
+
+@app.route('/ocr_document', methods=['POST'])
+def ocr_document():
+    """Recognize a multi-page document and stream the text page by page.
+
+    Takes any number of multipart files in fields `file` or `image`, in page
+    order: PDFs, multi-frame TIFFs or single images. The response is NDJSON,
+    one {"page": n, "text": ...} line per page (or "error" if that page
+    failed) in page order as soon as each is ready, then
+    {"done": true, "pages": n}. One tts_logs row records the full text.
+    """
+    try:
         if not TESSERACT_AVAILABLE:
             return jsonify({'error': 'Tesseract OCR binary not found on server. Install tesseract (system package) and restart the server.'}), 503
-        img_bytes = None
-        if request.files and 'image' in request.files:
-            f = request.files['image']
-            img_bytes = f.read()
-        else:
-            # JSON with {"b64": "..."}
+        try:
+            files = request.files.getlist('file') + request.files.getlist('image')
+        except RequestEntityTooLarge:
+            return jsonify({'error': f'Upload too large (over {UPLOAD_MAX_BYTES} bytes)'}), 413
+        if not files:
+            return jsonify({'error': 'No document provided (fields "file" or "image")'}), 400
+
+        pages = []
+        stored = []
+        for f in files:
+            upload = ImageUpload(f.stream)
+            try:
+                upload.inspect()
+            except Exception as e:
+                upload.close()
+                return jsonify({'error': f'Failed to parse {f.filename or "upload"}: {e}'}), 400
+            kind = 'pdf' if upload.format == 'PDF' else 'image'
+            if kind == 'image':
+                # frame count and size are known from the header, so refuse before storing
+                if UPLOAD_MAX_PIXELS and upload.pixels > UPLOAD_MAX_PIXELS:
+                    upload.close()
+                    return jsonify({'error': f'Image too large (over {UPLOAD_MAX_PIXELS} pixels)'}), 413
+                if len(pages) + upload.pages > OCR_DOCUMENT_MAX_PAGES:
+                    upload.close()
+                    return jsonify({'error': f'Too many pages (over {OCR_DOCUMENT_MAX_PAGES})'}), 413
+            elif not (PDFTOPPM_CMD and PDFINFO_CMD):
+                upload.close()
+                return jsonify({'error': 'PDF support needs poppler-utils (pdftoppm and pdfinfo) on the server'}), 501
+            # the stored copy is what the OCR workers read
+            path = upload.save()
+            upload.close()
+            if not path:
+                return jsonify({'error': 'Failed to store upload'}), 500
+            stored.append(path)
+            if kind == 'pdf':
+                try:
+                    count = pdf_page_count(path)
+                except Exception as e:
+                    return jsonify({'error': f'Failed to read PDF {f.filename or ""}: {e}'}), 400
+            else:
+                count = upload.pages
+            if len(pages) + count > OCR_DOCUMENT_MAX_PAGES:
+                return jsonify({'error': f'Too many pages (over {OCR_DOCUMENT_MAX_PAGES})'}), 413
+            for n in range(count):
+                # a plain image shares its cache entry with /ocr_upload
+                key = f"{upload.digest}|{_OCR_PARAMS_DIGEST}" if kind == 'image' and count == 1 \
+                    else f"{upload.digest}:{n}|{_OCR_PARAMS_DIGEST}"
+                pages.append((path, n, kind, key))
+
+        results = ocr_pages(pages)
+        try:
+            # wait for the first page here so a full OCR queue still gets a 503
+            first = next(results)
+        except OCRBusyError:
+            return jsonify({'error': 'OCR is busy, try again shortly'}), 503, {'Retry-After': '5'}
+
+        def generate():
+            texts = []
+            for i, text, error in itertools.chain([first], results):
+                line = {'page': i + 1, 'text': text} if text is not None else {'page': i + 1, 'error': error}
+                texts.append(text or '')
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+            yield json.dumps({'done': True, 'pages': len(pages)}) + '\n'
+            save_tts_log(ocr_text='\n\n'.join(t for t in texts if t), image=stored[0], voice='ocr', slow=False)
+
+        resp = Response(generate(), mimetype='application/x-ndjson')
+        resp.headers['Cache-Control'] = 'no-store'
+        resp.headers['X-Accel-Buffering'] = 'no'
+        return resp
+    except Exception as e:
+        log.exception('ocr_document failed')
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route("/")
+def index():
+    return "Amharic TTS server running"
+
+
+@app.errorhandler(404)
+def log_404(e):
+    try:
+        if log.isEnabledFor(logging.DEBUG):
+            # Useful WSGI/env keys
+            env = request.environ
+            keys = ('RAW_URI', 'REQUEST_URI', 'PATH_INFO', 'QUERY_STRING', 'SCRIPT_NAME')
+            log.debug('not found', extra=_kv(method=request.method, full_path=request.full_path,
+                                             env={k: env.get(k) for k in keys if k in env}))
+    except Exception:
+        pass
+    return e, 404
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({'error': f'Request too large (over {UPLOAD_MAX_BYTES} bytes)'}), 413
+
+
+@app.route('/ui')
+def ui():
+    path = os.path.join(BASE_DIR, 'static', 'ui.html')
+    return send_file(path)
+
+
+@app.route('/latest.mp3')
+@app.route('/latest/<channel>.mp3')
+def latest_mp3(channel=LATEST_DEFAULT_CHANNEL):
+    """The most recent clip; pollers revalidate with If-None-Match / If-Modified-Since."""
+    if not _CHANNEL_RE.match(channel):
+        return jsonify({'error': 'invalid channel'}), 400
+    entry = LATEST.get(channel)
+    if not entry:
+        return jsonify({'error': 'no latest file'}), 404
+    key, at = entry['key'], entry['at']
+    data = HOT_AUDIO.get(key)
+    if data is None:
+        # made by another worker, which may still be writing it
+        path = AUDIO_CACHE.get(key, count=False)
+        deadline = time.monotonic() + LATEST_WAIT_SECONDS
+        while not path and time.monotonic() < deadline:
+            time.sleep(0.05)
+            path = AUDIO_CACHE.get(key, count=False)
+        if not path:
+            return jsonify({'error': 'no latest file'}), 404
+        if os.path.getsize(path) > HOT_AUDIO_MAX_ITEM_BYTES:
+            return send_audio(path, key, last_modified=at)
+        # load it once; later pulls are served from memory
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        HOT_AUDIO.put(key, data, persisted=True)
+    return send_audio(data, key, last_modified=at)
+
+
+@app.route("/tts_b64", methods=["POST"])
+def text_to_speech_b64():
+    try:
+        _debug_dump_request('tts_b64 request body')
+        t_decode = time.perf_counter()
+        raw = request.get_data(cache=True)
+
+        b64 = None
+        # JSON body with {"b64": "..."}
+        if request.is_json:
+            data = request.get_json(silent=True)
+            if data:
+                b64 = data.get("b64")
+
+        # Form-data
+        if not b64 and request.form:
+            b64 = request.form.get("b64")
+
+        # Raw body: treat as plain base64 string
+        if not b64 and raw:
+            try:
+                b64 = raw.decode("utf-8").strip()
+            except Exception:
+                b64 = None
+
+        if not b64:
+            return jsonify({"error": "No base64 payload provided (field 'b64')"}), 400
+
+        # Decode base64 to UTF-8 text
+        try:
+            decoded_bytes = base64.b64decode(b64)
+            text = decoded_bytes.decode("utf-8")
+        except Exception as e:
+            log.info('failed to decode base64', extra=_kv(error=str(e)))
+            return jsonify({"error": "Failed to decode base64 payload"}), 400
+        record_timing('decode', time.perf_counter() - t_decode)
+
+        # detect slow flag if provided in JSON body
+        slow = False
+        try:
             if request.is_json:
-                data = request.get_json(silent=True)
-                if data and data.get('b64'):
+                data = request.get_json(silent=True) or {}
+                slow = _parse_bool(data.get('slow'))
+            if not slow and request.form:
+                slow = _parse_bool(request.form.get('slow'))
+        except Exception:
+            slow = False
+
+        log.debug('tts text', extra=_kv(text=_truncate(text), chars=len(text), slow=slow))
+
+        persist = _wants_persist()
+        key, source, hit = synthesize_clip(text, slow, persist=persist)
+
+        log.debug('audio ready', extra=_kv(file=f"{key}.mp3", cached=hit, persist=persist))
+
+        # update latest file
+        set_latest(key, request_channel())
+
+        # save log to DB if available (record typed text and audio path)
+        if persist:
+            try:
+                save_tts_log(typed_text=text, audio_filename=audio_path(key), voice=('server_slow' if slow else 'server'), slow=slow)
+            except Exception:
+                pass
+
+        with stage_timer('send'):
+            return send_audio(source, key)
+
+
+    except Exception as e:
+        log.exception('tts_b64 failed')
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/tts_stream", methods=["GET", "POST"])
+def text_to_speech_stream():
+    """Stream MP3 audio with chunked transfer encoding, one sentence at a time.
+
+    Accepts `text` or URL-safe `b64` from the query string, a JSON body with
+    the same fields, or a raw UTF-8 body.
+    """
+    try:
+        data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        text = request.args.get('text') or data.get('text')
+        b64 = request.args.get('b64') or data.get('b64')
+        if not text and b64:
+            try:
+                padding = len(b64) % 4
+                if padding:
+                    b64 += "=" * (4 - padding)
+                text = base64.urlsafe_b64decode(b64).decode("utf-8")
+            except Exception:
+                return jsonify({"error": "Failed to decode base64 payload"}), 400
+        if not text and request.method == 'POST' and not data:
+            text = request.get_data(cache=True).decode("utf-8", errors="replace").strip()
+        if not text:
+            return jsonify({"error": "No text to send to TTS API"}), 400
+
+        slow = _parse_bool(request.args.get('slow')) or _parse_bool(data.get('slow'))
+        log.debug('tts text', extra=_kv(text=_truncate(text), chars=len(text), slow=slow))
+
+        return speech_response(text, slow, _wants_persist(data), request_channel(data))
+
+    except Exception as e:
+        log.exception('tts_stream failed')
+        return jsonify({"error": str(e)}), 500
+
+
+def speech_response(text, slow, persist, channel, log_fields=None):
+    """Response with the audio for `text`: the cached clip, or a sentence stream."""
+    key = cache_key(text, TTS_LANG, slow)
+    source = HOT_AUDIO.get(key)
+    if source:
+        _keep_clip(key, source, persist)
+    else:
+        source = AUDIO_CACHE.get(key)
+    if source:
+        set_latest(key, channel)
+        if persist:
+            save_tts_log(audio_filename=audio_path(key), voice=('server_slow' if slow else 'server'), slow=slow,
+                         **(log_fields or {'typed_text': text}))
+        log.debug('audio ready', extra=_kv(file=f"{key}.mp3", cached=True))
+        with stage_timer('send'):
+            return send_audio(source, key)
+
+    chunks = stream_synthesis(text, slow, persist=persist, channel=channel, log_fields=log_fields)
+    # wait for the first sentence here so upstream failures still get a 500
+    first = next(chunks)
+    resp = Response(itertools.chain([first], chunks), mimetype="audio/mpeg")
+    resp.headers['Cache-Control'] = 'no-store'
+    resp.headers['X-Audio-Id'] = key
+    # keep reverse proxies from buffering the whole stream
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+@app.route("/tts_b64_get", methods=["GET"])
+def text_to_speech_b64_get():
+    try:
+        t_decode = time.perf_counter()
+        b64 = request.args.get("b64")
+        if not b64:
+            return jsonify({"error": "Missing 'b64' query parameter"}), 400
+
+        # Accept URL-safe base64 as well
+        try:
+            # Normalize padding
+            padding = len(b64) % 4
+            if padding:
+                b64 += "=" * (4 - padding)
+            decoded_bytes = base64.urlsafe_b64decode(b64)
+            text = decoded_bytes.decode("utf-8")
+        except Exception:
+            return jsonify({"error": "Failed to decode base64 query parameter"}), 400
+        record_timing('decode', time.perf_counter() - t_decode)
+
+        # read slow flag from query
+        slow = _parse_bool(request.args.get('slow'))
+        log.debug('tts text', extra=_kv(text=_truncate(text), chars=len(text), slow=slow))
+
+        key, source, hit = synthesize_clip(text, slow, persist=_wants_persist())
+
+        log.debug('audio ready', extra=_kv(file=f"{key}.mp3", cached=hit))
+        # update latest file
+        set_latest(key, request_channel())
+
+        with stage_timer('send'):
+            return send_audio(source, key)
+
+    except Exception as e:
+        log.exception('tts_b64_get failed')
+        return jsonify({"error": str(e)}), 500
+
+
+# --- Batch synthesis ---
+TTS_BATCH_MAX_ITEMS = int(os.environ.get('TTS_BATCH_MAX_ITEMS', 500))
+TTS_BATCH_WORKERS = int(os.environ.get('TTS_BATCH_WORKERS', 4))
+# items run here; their sentences still go through SYNTH_POOL
+BATCH_POOL = ThreadPoolExecutor(max_workers=TTS_BATCH_WORKERS, thread_name_prefix='batch')
+
+_AUDIO_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class _ZipStream:
+    """Write-only sink for zipfile that hands out what was written so far."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def write(self, data):
+        self._buf += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+def _parse_batch_items(data):
+    """Return [(text, slow)] from a JSON array or {"items": [...]} body."""
+    default_slow = False
+    if isinstance(data, dict):
+        default_slow = _parse_bool(data.get('slow'))
+        data = data.get('items')
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array of texts or {"items": [...]}')
+    items = []
+    for item in data:
+        if isinstance(item, str):
+            text, slow = item, default_slow
+        elif isinstance(item, dict):
+            text = item.get('text')
+            if not text and item.get('b64'):
+                text = base64.b64decode(item['b64']).decode('utf-8')
+            slow = _parse_bool(item['slow']) if 'slow' in item else default_slow
+        else:
+            raise ValueError('Batch items must be strings or objects')
+        items.append(((text or '').strip(), slow))
+    return items
+
+
+def _batch_item(text, slow):
+    if not text:
+        raise ValueError('empty text')
+    return synthesize_cached(text, slow)
+
+
+@app.route('/tts_batch', methods=['POST'])
+def text_to_speech_batch():
+    """Synthesize many texts concurrently.
+
+    Returns a JSON manifest of audio ids and URLs, or a streamed ZIP of the
+    MP3s (plus manifest.json) with `?format=zip`.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if data is None:
+            return jsonify({"error": "Expected a JSON body"}), 400
+        try:
+            items = _parse_batch_items(data)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+        if not items:
+            return jsonify({"error": "No texts provided"}), 400
+        if len(items) > TTS_BATCH_MAX_ITEMS:
+            return jsonify({"error": f"At most {TTS_BATCH_MAX_ITEMS} items per batch"}), 413
+        fmt = request.args.get('format') or (data.get('format') if isinstance(data, dict) else None) or 'json'
+
+        log.info('batch', extra=_kv(items=len(items), format=fmt))
+        futures = [BATCH_POOL.submit(_batch_item, text, slow) for text, slow in items]
+
+        def manifest_and_logs(missing=None):
+            manifest, logs = [], []
+            for i, ((text, slow), f) in enumerate(zip(items, futures)):
+                entry = {'index': i, 'slow': slow}
+                try:
+                    filepath, reused = f.result()
+                    if missing and i in missing:
+                        raise missing[i]
+                except Exception as e:
+                    entry['error'] = str(e)
+                    manifest.append(entry)
+                    continue
+                audio_id = os.path.splitext(os.path.basename(filepath))[0]
+                entry.update({'id': audio_id, 'url': f"/audio/{audio_id}.mp3", 'cached': reused})
+                manifest.append(entry)
+                logs.append({'typed_text': text, 'audio_filename': filepath, 'voice': 'batch', 'slow': slow})
+            save_tts_logs(logs)
+            return manifest
+
+        if fmt != 'zip':
+            manifest = manifest_and_logs()
+            return jsonify({'items': manifest, 'errors': sum(1 for m in manifest if 'error' in m)})
+
+        def read_clip(i, filepath):
+            try:
+                with open(filepath, 'rb') as fh:
+                    return fh.read()
+            except FileNotFoundError:
+                # evicted or swept since its future resolved; synthesize it again
+                filepath, _ = _batch_item(*items[i])
+                with open(filepath, 'rb') as fh:
+                    return fh.read()
+
+        def zip_stream():
+            sink = _ZipStream()
+            missing = {}
+            with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+                for i, f in enumerate(futures):
                     try:
-                        img_bytes = base64.b64decode(data.get('b64'))
+                        filepath, _ = f.result()
                     except Exception:
-                        img_bytes = None
-            if not img_bytes:
-                raw = request.get_data(cache=True)
-                if raw:
-                    s = raw.decode('utf-8', errors='ignore').strip()
+                        continue
                     try:
-                        img_bytes = base64.b64decode(s)
-                    except Exception:
-                        img_bytes = None
+                        data = read_clip(i, filepath)
+                    except Exception as e:
+                        missing[i] = e
+                        continue
+                    zf.writestr(f"{i:04d}.mp3", data)
+                    yield sink.drain()
+                zf.writestr('manifest.json', json.dumps({'items': manifest_and_logs(missing)}, ensure_ascii=False))
+            yield sink.drain()
+
+        resp = Response(zip_stream(), mimetype='application/zip')
+        resp.headers['Content-Disposition'] = 'attachment; filename="tts_batch.zip"'
+        return resp
+    except Exception as e:
+        log.exception('tts_batch failed')
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/audio/<audio_id>.mp3')
+def audio_by_id(audio_id):
+    """Serve a clip by the id from /tts_batch or a TTS response's X-Audio-Id header."""
+    if not _AUDIO_ID_RE.match(audio_id):
+        return jsonify({'error': 'invalid audio id'}), 400
+    source = HOT_AUDIO.get(audio_id) or AUDIO_CACHE.get(audio_id, count=False)
+    if not source:
+        return jsonify({'error': 'unknown audio id'}), 404
+    return send_audio(source, audio_id, immutable=True)
+
+
+# --- Background jobs ---
+# Long documents are synthesized off the request thread: POST /jobs returns an
+# id immediately and the work runs on a bounded pool. Job state lives in the
+# database so clients can keep polling across restarts. A running job's
+# updated_at is refreshed as a heartbeat; every process periodically requeues
+# jobs whose heartbeat stopped (their process died) and resubmits queued jobs
+# that no process picked up.
+JOBS_MAX_WORKERS = int(os.environ.get('JOBS_MAX_WORKERS', 2))
+JOBS_MAX_QUEUED = int(os.environ.get('JOBS_MAX_QUEUED', 100))
+JOBS_TTL_SECONDS = int(os.environ.get('JOBS_TTL_SECONDS', 24 * 3600))
+# a 'running' job untouched for this long is assumed orphaned by a restart
+JOBS_STALE_SECONDS = int(os.environ.get('JOBS_STALE_SECONDS', 600))
+JOBS_HEARTBEAT_SECONDS = max(1.0, JOBS_STALE_SECONDS / 4)
+
+JOB_POOL = ThreadPoolExecutor(max_workers=JOBS_MAX_WORKERS, thread_name_prefix='job')
+_JOB_SLOTS = threading.BoundedSemaphore(JOBS_MAX_QUEUED)
+
+
+def _update_job(job_id, **fields):
+    sess = DB_Session()
+    try:
+        fields['updated_at'] = datetime.utcnow()
+        sess.query(TTSJob).filter(TTSJob.id == job_id).update(fields)
+        sess.commit()
+    finally:
+        sess.close()
+
+
+def _claim_job(job_id):
+    """Atomically move a queued job to running; False if someone else has it."""
+    sess = DB_Session()
+    try:
+        n = sess.query(TTSJob).filter(TTSJob.id == job_id, TTSJob.status == 'queued') \
+            .update({'status': 'running', 'updated_at': datetime.utcnow()})
+        sess.commit()
+        return n == 1
+    finally:
+        sess.close()
 
-        if not img_bytes:
-            return jsonify({'error': 'No image provided (field "image" or JSON {"b64":"..."})'}), 400
 
+def _job_heartbeat(job_id, stop):
+    while not stop.wait(JOBS_HEARTBEAT_SECONDS):
         try:
-            from PIL import Image
-            import pytesseract
+            _update_job(job_id)
         except Exception as e:
-            return jsonify({'error': 'Server OCR not available. Install Pillow and pytesseract with system Tesseract. ' + str(e)}), 500
+            log.warning('job heartbeat failed', extra=_kv(job=job_id, error=str(e)))
 
+
+def _run_job(job_id):
+    stop = threading.Event()
+    try:
+        if not _claim_job(job_id):
+            return
+        threading.Thread(target=_job_heartbeat, args=(job_id, stop), daemon=True).start()
+        sess = DB_Session()
         try:
-            img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-        except Exception as e:
-            return jsonify({'error': 'Failed to parse image: ' + str(e)}), 400
+            job = sess.get(TTSJob, job_id)
+            kind, text, image, slow = job.kind, job.text, job.image, job.slow
+        finally:
+            sess.close()
+
+        if kind == 'image' and not text:
+            text = ocr_image(image, timeout=None)
+            _update_job(job_id, text=text)
+            if not text:
+                _update_job(job_id, status='failed', error='No text found in image')
+                return
+
+        key = cache_key(text, TTS_LANG, slow)
+        filepath = AUDIO_CACHE.get(key)
+        if not filepath:
+            segments = (text_segments(text) if SEGMENT_CACHE is not None else split_sentences(text)) or [text]
+            _update_job(job_id, segments_total=len(segments))
+            futures = synthesize_segments(segments, slow)
+            for i, f in enumerate(futures):
+                f.result()
+                _update_job(job_id, segments_done=i + 1)
+            tmp_path = os.path.join(AUDIO_DIR, f"{uuid.uuid4()}.mp3.part")
+            with open(tmp_path, 'wb') as fh:
+                fh.write(mp3_concat([f.result() for f in futures]))
+            filepath = AUDIO_CACHE.put(key, tmp_path)
+        else:
+            _update_job(job_id, segments_total=1, segments_done=1)
 
-        # Try Amharic language first, fall back to English or default
-        text = ''
+        _update_job(job_id, status='done', audio_filename=filepath)
+        if kind == 'image':
+            save_tts_log(ocr_text=text, image=image, audio_filename=filepath, voice='job', slow=slow)
+        else:
+            save_tts_log(typed_text=text, audio_filename=filepath, voice='job', slow=slow)
+        log.info('job done', extra=_kv(job=job_id, file=os.path.basename(filepath)))
+    except Exception as e:
+        log.exception('job failed', extra=_kv(job=job_id))
         try:
-            text = pytesseract.image_to_string(img, lang='amh')
+            _update_job(job_id, status='failed', error=str(e))
         except Exception:
+            log.exception('failed to record job failure', extra=_kv(job=job_id))
+    finally:
+        stop.set()
+        _JOB_SLOTS.release()
+
+
+def submit_job(job_id, block=False):
+    """Queue a job on JOB_POOL; returns False when the queue is full."""
+    if not _JOB_SLOTS.acquire(blocking=block):
+        return False
+    JOB_POOL.submit(_run_job, job_id)
+    return True
+
+
+def _job_json(job):
+    out = {
+        'id': job.id,
+        'status': job.status,
+        'kind': job.kind,
+        'slow': bool(job.slow),
+        'progress': {'done': job.segments_done or 0, 'total': job.segments_total or 0},
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+    }
+    if job.status == 'done':
+        out['audio_url'] = f"/jobs/{job.id}/audio"
+    if job.error:
+        out['error'] = job.error
+    return out
+
+
+def _submit_waiting(ids):
+    for job_id in ids:
+        # pending work waits for a slot instead of being dropped
+        threading.Thread(target=submit_job, args=(job_id, True), daemon=True).start()
+
+
+def _resume_jobs():
+    """Requeue jobs left behind by a previous run."""
+    _requeue_stale_jobs()
+    sess = DB_Session()
+    try:
+        ids = [r.id for r in sess.query(TTSJob.id).filter(TTSJob.status == 'queued').order_by(TTSJob.created_at)]
+    finally:
+        sess.close()
+    _submit_waiting(ids)
+    if ids:
+        log.info('resumed jobs', extra=_kv(count=len(ids)))
+
+
+def _requeue_stale_jobs():
+    """Take over jobs whose heartbeat stopped; returns the ids this process resubmitted.
+
+    A running job untouched for JOBS_STALE_SECONDS lost its process; a queued
+    one was never picked up (e.g. its process died before claiming it). Each
+    is taken by one process, which marks it queued and touched, and submits it.
+    """
+    sess = DB_Session()
+    taken = []
+    try:
+        stale = datetime.utcfromtimestamp(time.time() - JOBS_STALE_SECONDS)
+        waiting = (TTSJob.status.in_(('queued', 'running')), TTSJob.updated_at < stale)
+        ids = [r.id for r in sess.query(TTSJob.id).filter(*waiting).order_by(TTSJob.created_at)]
+        for job_id in ids:
+            n = sess.query(TTSJob).filter(TTSJob.id == job_id, *waiting) \
+                .update({'status': 'queued', 'updated_at': datetime.utcnow()}, synchronize_session=False)
+            sess.commit()
+            if n:
+                taken.append(job_id)
+    finally:
+        sess.close()
+    return taken
+
+
+def _job_cleanup_loop():
+    while True:
+        time.sleep(min(JOBS_TTL_SECONDS, JOBS_STALE_SECONDS / 2, 600))
+        try:
+            requeued = _requeue_stale_jobs()
+            _submit_waiting(requeued)
+            if requeued:
+                log.info('requeued stale jobs', extra=_kv(count=len(requeued)))
+        except Exception as e:
+            log.error('job requeue failed', extra=_kv(error=str(e)))
+        try:
+            cutoff = datetime.utcfromtimestamp(time.time() - JOBS_TTL_SECONDS)
+            sess = DB_Session()
+            try:
+                n = sess.query(TTSJob).filter(TTSJob.status.in_(('done', 'failed')), TTSJob.updated_at < cutoff) \
+                    .delete(synchronize_session=False)
+                sess.commit()
+            finally:
+                sess.close()
+            if n:
+                log.info('removed expired jobs', extra=_kv(count=n))
+        except Exception as e:
+            log.error('job cleanup failed', extra=_kv(error=str(e)))
+
+
+@background_service
+def _start_job_services():
+    if not SQLALCHEMY_AVAILABLE:
+        return
+    _resume_jobs()
+    threading.Thread(target=_job_cleanup_loop, daemon=True).start()
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a text, base64 text or image for synthesis and return its id."""
+    try:
+        if not SQLALCHEMY_AVAILABLE:
+            return jsonify({'error': 'Jobs need a database; install SQLAlchemy'}), 503
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        text = data.get('text') or request.form.get('text')
+        b64 = data.get('b64') or request.form.get('b64')
+        slow = _parse_bool(data.get('slow')) or _parse_bool(request.form.get('slow')) or _parse_bool(request.args.get('slow'))
+        upload = None
+        if request.files and 'image' in request.files:
+            upload = ImageUpload(request.files['image'].stream)
+        elif data.get('image_b64'):
+            try:
+                upload = ImageUpload.from_bytes(base64.b64decode(data.get('image_b64')))
+            except Exception:
+                return jsonify({'error': 'Failed to decode image_b64'}), 400
+        if not text and b64:
             try:
-                text = pytesseract.image_to_string(img, lang='eng')
+                text = base64.b64decode(b64).decode('utf-8')
             except Exception:
-                text = pytesseract.image_to_string(img)
+                return jsonify({'error': 'Failed to decode base64 payload'}), 400
 
-        text = (text or '').strip()
-        # save uploaded image to `uploads/` and optionally log OCR results
-        image_path = None
-        try:
-            image_filename = f"{uuid.uuid4()}.png"
-            image_path = os.path.join(UPLOADS_DIR, image_filename)
-            with open(image_path, 'wb') as fh:
-                fh.write(img_bytes)
-        except Exception:
-            image_path = None
+        job_id = str(uuid.uuid4())
+        if upload is not None:
+            if not TESSERACT_AVAILABLE:
+                upload.close()
+                return jsonify({'error': 'Tesseract OCR binary not found on server.'}), 503
+            error = _check_image(upload)
+            if error:
+                return error
+            image_path = upload.save()
+            upload.close()
+            if not image_path:
+                return jsonify({'error': 'Failed to store image'}), 500
+            job = TTSJob(id=job_id, kind='image', image=image_path, slow=slow)
+        elif text:
+            job = TTSJob(id=job_id, kind='text', text=text, slow=slow)
+        else:
+            return jsonify({'error': 'Provide "text", "b64", "image_b64" or an "image" file'}), 400
 
+        sess = DB_Session()
         try:
-            if SQLALCHEMY_AVAILABLE:
-                save_tts_log(ocr_text=text, image=image_path, audio_filename=None, voice='ocr', slow=False)
-        except Exception:
-            pass
-        return jsonify({'text': text})
+            sess.add(job)
+            sess.commit()
+            body = _job_json(job)
+        finally:
+            sess.close()
+
+        if not submit_job(job_id):
+            _update_job(job_id, status='failed', error='Job queue is full')
+            return jsonify({'error': 'Job queue is full, retry later', 'id': job_id}), 503
+        log.info('job queued', extra=_kv(job=job_id, kind=job.kind))
+        return jsonify(body), 202
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
-        traceback.print_exc()
+        log.exception('create job failed')
         return jsonify({'error': str(e)}), 500
 
 
-@app.route("/")
-def index():
-    return "Amharic TTS server running"
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if not SQLALCHEMY_AVAILABLE:
+        return jsonify({'error': 'Jobs need a database; install SQLAlchemy'}), 503
+    sess = DB_Session()
+    try:
+        job = sess.get(TTSJob, job_id)
+        if job is None:
+            return jsonify({'error': 'unknown job'}), 404
+        return jsonify(_job_json(job))
+    finally:
+        sess.close()
 
 
-@app.errorhandler(404)
-def log_404(e):
+@app.route('/jobs/<job_id>/audio', methods=['GET'])
+def get_job_audio(job_id):
+    if not SQLALCHEMY_AVAILABLE:
+        return jsonify({'error': 'Jobs need a database; install SQLAlchemy'}), 503
+    sess = DB_Session()
     try:
-        print("--- 404 handler ---")
-        print("Method:", request.method)
-        print("Path:", request.path)
-        print("Full Path:", request.full_path)
-        print("Headers:", dict(request.headers))
-        # Useful WSGI/env keys
-        env = request.environ
-        for k in ('RAW_URI','REQUEST_URI','PATH_INFO','QUERY_STRING','SCRIPT_NAME'):
-            if k in env:
-                print(f"ENV {k}:", env.get(k))
-    except Exception:
-        pass
-    return e, 404
+        job = sess.get(TTSJob, job_id)
+        status = job.status if job else None
+        filepath = job.audio_filename if job else None
+    finally:
+        sess.close()
+    if status is None:
+        return jsonify({'error': 'unknown job'}), 404
+    if status != 'done':
+        return jsonify({'error': 'job is not done', 'status': status}), 409
+    if not filepath or not os.path.exists(filepath):
+        return jsonify({'error': 'audio no longer available'}), 410
+    return send_file(filepath, mimetype='audio/mpeg')
 
 
-@app.route('/ui')
-def ui():
-    path = os.path.join(BASE_DIR, 'static', 'ui.html')
-    print("Serving UI from:", path, "exists:", os.path.exists(path))
-    return send_file(path)
+# --- Settings ---
+# Every process keeps the settings table in memory. Writers bump a counter in
+# the reserved `__version__` row (created at startup) in the same transaction,
+# and readers compare it at most every SETTINGS_CHECK_SECONDS, reloading only
+# when it moved, so other workers' writes show up within that window.
+SETTINGS_CHECK_SECONDS = float(os.environ.get('SETTINGS_CHECK_SECONDS', 2.0))
+SETTINGS_VERSION_KEY = '__version__'
+SETTINGS_MAX_KEY_LENGTH = 128
 
 
-@app.route('/latest.mp3')
-def latest_mp3():
-    if LATEST_FILE and os.path.exists(LATEST_FILE):
-        return send_file(LATEST_FILE, mimetype='audio/mpeg')
-    return jsonify({'error': 'no latest file'}), 404
+class SettingsStore:
+    def __init__(self, check_seconds):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._values = {}
+        self._version = None
+        self._checked = 0.0
+        self.reloads = 0
 
+    def ensure_version_row(self):
+        """Create the `__version__` row once; workers starting together may race to it."""
+        if not SQLALCHEMY_AVAILABLE:
+            return
+        sess = DB_Session()
+        try:
+            if sess.query(Setting.id).filter(Setting.key == SETTINGS_VERSION_KEY).one_or_none():
+                return
+            now = datetime.utcnow()
+            sess.add(Setting(key=SETTINGS_VERSION_KEY, value='0', created_at=now, updated_at=now))
+            sess.commit()
+        except IntegrityError:
+            # another worker inserted it first
+            sess.rollback()
+        except Exception as e:
+            sess.rollback()
+            log.error('failed to create settings version row', extra=_kv(error=str(e)))
+        finally:
+            sess.close()
 
-@app.route("/tts_b64", methods=["POST"])
-def text_to_speech_b64():
-    try:
-        print("\n📥 NEW B64 REQUEST")
-        print("Headers:", dict(request.headers))
-        raw = request.get_data(cache=True)
-        print("Raw data:", raw)
+    def _db_version(self, sess):
+        row = sess.query(Setting.value).filter(Setting.key == SETTINGS_VERSION_KEY).one_or_none()
+        return int(row[0]) if row else 0
 
-        b64 = None
-        # JSON body with {"b64": "..."}
-        if request.is_json:
-            data = request.get_json(silent=True)
-            if data:
-                b64 = data.get("b64")
+    def _refresh(self, force=False):
+        if not SQLALCHEMY_AVAILABLE:
+            return
+        now = time.monotonic()
+        if not force and self._version is not None and now - self._checked < self.check_seconds:
+            return
+        with self._lock:
+            if not force and self._version is not None and now - self._checked < self.check_seconds:
+                return
+            sess = DB_Session()
+            try:
+                with stage_timer('db'):
+                    version = self._db_version(sess)
+                    if force or version != self._version:
+                        rows = sess.query(Setting.key, Setting.value).all()
+                        self._values = {k: v for k, v in rows if k != SETTINGS_VERSION_KEY}
+                        self._version = version
+                        self.reloads += 1
+                self._checked = time.monotonic()
+            except Exception as e:
+                # keep serving the last known values; retry on the next read
+                log.error('failed to refresh settings', extra=_kv(error=str(e)))
+            finally:
+                sess.close()
 
-        # Form-data
-        if not b64 and request.form:
-            b64 = request.form.get("b64")
+    def all(self):
+        """Return (a copy of) every setting as raw strings."""
+        self._refresh()
+        return dict(self._values)
 
-        # Raw body: treat as plain base64 string
-        if not b64 and raw:
-            try:
-                b64 = raw.decode("utf-8").strip()
-            except Exception:
-                b64 = None
+    def version(self):
+        self._refresh()
+        return self._version or 0
 
-        if not b64:
-            return jsonify({"error": "No base64 payload provided (field 'b64')"}), 400
+    def update(self, values):
+        """Upsert `values` in one transaction; a value of None deletes the key.
 
-        # Decode base64 to UTF-8 text
+        Returns the new version, or None if the write failed.
+        """
+        if not SQLALCHEMY_AVAILABLE:
+            return None
+        sess = DB_Session()
         try:
-            decoded_bytes = base64.b64decode(b64)
-            text = decoded_bytes.decode("utf-8")
+            with stage_timer('db'):
+                now = datetime.utcnow()
+                existing = {r.key: r for r in sess.query(Setting).filter(Setting.key.in_(list(values))).all()}
+                for key, value in values.items():
+                    row = existing.get(key)
+                    if value is None:
+                        if row is not None:
+                            sess.delete(row)
+                    elif row is not None:
+                        row.value = value
+                        row.updated_at = now
+                    else:
+                        sess.add(Setting(key=key, value=value, created_at=now, updated_at=now))
+                # bump the counter in SQL so concurrent writers never reuse a version
+                bumped = sess.execute(
+                    update(Setting)
+                    .where(Setting.key == SETTINGS_VERSION_KEY)
+                    .values(value=cast(cast(Setting.value, Integer) + 1, Text), updated_at=now)
+                ).rowcount
+                if not bumped:
+                    raise RuntimeError(f'settings row {SETTINGS_VERSION_KEY!r} is missing')
+                sess.commit()
         except Exception as e:
-            print("Failed to decode base64:", e)
-            return jsonify({"error": "Failed to decode base64 payload"}), 400
+            sess.rollback()
+            log.error('failed to update settings', extra=_kv(keys=sorted(values), error=str(e)))
+            return None
+        finally:
+            sess.close()
+        self._refresh(force=True)
+        return self._version
 
-        # detect slow flag if provided in JSON body
-        slow = False
+    def stats(self):
+        return {'keys': len(self._values), 'version': self._version, 'reloads': self.reloads}
+
+
+SETTINGS = SettingsStore(SETTINGS_CHECK_SECONDS)
+SETTINGS.ensure_version_row()
+
+
+def _decode_setting(value):
+    # /settings stores JSON so the UI gets its numbers and booleans back;
+    # anything else written through upsert_setting comes back as a string
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+@app.route('/settings', methods=['GET'])
+def get_settings():
+    if not SQLALCHEMY_AVAILABLE:
+        return jsonify({'error': 'Settings need a database; install SQLAlchemy'}), 503
+    values = SETTINGS.all()
+    return jsonify({'settings': {k: _decode_setting(v) for k, v in values.items()},
+                    'version': SETTINGS.version()})
+
+
+@app.route('/settings', methods=['PUT', 'POST'])
+def put_settings():
+    """Upsert a JSON object of settings in one transaction; null deletes a key."""
+    if not SQLALCHEMY_AVAILABLE:
+        return jsonify({'error': 'Settings need a database; install SQLAlchemy'}), 503
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('settings'), dict):
+        data = data['settings']
+    if not isinstance(data, dict) or not data:
+        return jsonify({'error': 'Expected a non-empty JSON object of settings'}), 400
+    values = {}
+    for key, value in data.items():
+        if not key or len(key) > SETTINGS_MAX_KEY_LENGTH or key == SETTINGS_VERSION_KEY:
+            return jsonify({'error': f'Invalid setting key: {key!r}'}), 400
+        values[key] = None if value is None else json.dumps(value, ensure_ascii=False)
+    version = SETTINGS.update(values)
+    if version is None:
+        return jsonify({'error': 'Failed to save settings'}), 500
+    return jsonify({'settings': {k: _decode_setting(v) for k, v in SETTINGS.all().items()},
+                    'version': version})
+
+
+# --- History ---
+# /history pages through tts_logs newest first with an opaque (created_at, id)
+# cursor, and /history/search does full-text search over typed and OCR text:
+# an FTS5 table kept in sync by triggers on SQLite, expression tsvector and
+# trigram indexes on Postgres. Postgres matches whole words through the
+# tsvector and, with pg_trgm, also substrings of at least
+# HISTORY_SUBSTRING_MIN_CHARS (words inside Amharic compounds, like FTS5's
+# prefix matches) through the trigram indexes.
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 50))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 200))
+# shorter patterns have no trigram to look up and would scan the whole index
+HISTORY_SUBSTRING_MIN_CHARS = 3
+
+_SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tts_logs_fts USING fts5("
+    "typed_text, ocr_text, content='tts_logs', content_rowid='id', tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS tts_logs_fts_ai AFTER INSERT ON tts_logs BEGIN "
+    "INSERT INTO tts_logs_fts(rowid, typed_text, ocr_text) VALUES (new.id, new.typed_text, new.ocr_text); END",
+    "CREATE TRIGGER IF NOT EXISTS tts_logs_fts_ad AFTER DELETE ON tts_logs BEGIN "
+    "INSERT INTO tts_logs_fts(tts_logs_fts, rowid, typed_text, ocr_text) "
+    "VALUES ('delete', old.id, old.typed_text, old.ocr_text); END",
+    "CREATE TRIGGER IF NOT EXISTS tts_logs_fts_au AFTER UPDATE OF typed_text, ocr_text ON tts_logs BEGIN "
+    "INSERT INTO tts_logs_fts(tts_logs_fts, rowid, typed_text, ocr_text) "
+    "VALUES ('delete', old.id, old.typed_text, old.ocr_text); "
+    "INSERT INTO tts_logs_fts(rowid, typed_text, ocr_text) VALUES (new.id, new.typed_text, new.ocr_text); END",
+)
+# must match the expression in the Postgres search query for the index to be used
+_PG_TSVECTOR = "to_tsvector('simple', coalesce(typed_text, '') || ' ' || coalesce(ocr_text, ''))"
+_PG_SEARCH_DDL = (
+    f"CREATE INDEX IF NOT EXISTS ix_tts_logs_fts ON tts_logs USING gin ({_PG_TSVECTOR})",
+    "CREATE INDEX IF NOT EXISTS ix_tts_logs_typed_trgm ON tts_logs USING gin (typed_text gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_tts_logs_ocr_trgm ON tts_logs USING gin (ocr_text gin_trgm_ops)",
+)
+HISTORY_SEARCH = None  # 'fts5', 'postgres' or None (LIKE fallback)
+# Postgres only: the trigram indexes exist, so substring matches are indexed
+HISTORY_TRIGRAM = False
+
+
+def _ensure_tts_log_indexes():
+    """Create tts_logs indexes (pagination, search, retention) on existing databases."""
+    global HISTORY_SEARCH, HISTORY_TRIGRAM
+    for idx in TTSLog.__table__.indexes:
+        idx.create(DB_ENGINE, checkfirst=True)
+    dialect = DB_ENGINE.dialect.name
+    if dialect == 'sqlite':
+        with DB_ENGINE.begin() as conn:
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE name = 'tts_logs_fts'").first() is not None
+            for stmt in _SQLITE_FTS_DDL:
+                conn.exec_driver_sql(stmt)
+            if not exists:
+                # index rows written before search existed
+                conn.exec_driver_sql("INSERT INTO tts_logs_fts(tts_logs_fts) VALUES ('rebuild')")
+        HISTORY_SEARCH = 'fts5'
+    elif dialect == 'postgresql':
+        with DB_ENGINE.begin() as conn:
+            conn.exec_driver_sql(_PG_SEARCH_DDL[0])
+        HISTORY_SEARCH = 'postgres'
         try:
-            if request.is_json:
-                data = request.get_json(silent=True) or {}
-                slow = _parse_bool(data.get('slow'))
-            if not slow and request.form:
-                slow = _parse_bool(request.form.get('slow'))
-        except Exception:
-            slow = False
+            with DB_ENGINE.begin() as conn:
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                for stmt in _PG_SEARCH_DDL[1:]:
+                    conn.exec_driver_sql(stmt)
+            HISTORY_TRIGRAM = True
+        except Exception as e:
+            # search then matches whole words only
+            log.warning('pg_trgm unavailable; search matches whole words only', extra=_kv(error=str(e)))
+
 
-        print("✅ TEXT RECEIVED (from b64):", text, "slow:", slow)
+if SQLALCHEMY_AVAILABLE:
+    try:
+        _ensure_tts_log_indexes()
+    except Exception as e:
+        log.warning('failed to create tts_logs indexes', extra=_kv(error=str(e)))
 
-        filename = f"{uuid.uuid4()}.mp3"
-        filepath = os.path.join(AUDIO_DIR, filename)
 
-        tts = gTTS(text=text, lang="am", slow=slow)
-        tts.save(filepath)
+def _encode_cursor(*parts):
+    raw = json.dumps(parts, default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
 
-        print("🔊 Audio saved:", filepath)
 
-        # update latest file
-        global LATEST_FILE
-        LATEST_FILE = filepath
+def _decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded))
 
-        # save log to DB if available (record typed text and audio path)
+
+def _history_json(r):
+    audio_id = None
+    if r.audio_filename:
+        name = os.path.splitext(os.path.basename(r.audio_filename))[0]
+        audio_id = name if _AUDIO_ID_RE.match(name) else None
+    return {
+        'id': r.id,
+        'created_at': r.created_at.isoformat() if r.created_at else None,
+        'typed_text': r.typed_text,
+        'ocr_text': r.ocr_text,
+        'voice': r.voice,
+        'slow': bool(r.slow),
+        'has_image': bool(r.image),
+        'audio_url': f"/audio/{audio_id}.mp3" if audio_id else None,
+    }
+
+
+def _history_filters(q):
+    """Apply the voice/slow/has_image query-string filters to a TTSLog query."""
+    voice = request.args.get('voice')
+    if voice:
+        q = q.filter(TTSLog.voice == voice)
+    if request.args.get('slow') is not None:
+        q = q.filter(TTSLog.slow == _parse_bool(request.args.get('slow')))
+    if request.args.get('has_image') is not None:
+        q = q.filter(TTSLog.image.isnot(None) if _parse_bool(request.args.get('has_image')) else TTSLog.image.is_(None))
+    return q
+
+
+def _page_size():
+    try:
+        n = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        n = HISTORY_PAGE_SIZE
+    return max(1, min(n, HISTORY_MAX_PAGE_SIZE))
+
+
+@app.route('/history', methods=['GET'])
+def history():
+    """Newest-first tts_logs with keyset pagination (`cursor` from the previous page)."""
+    if not SQLALCHEMY_AVAILABLE:
+        return jsonify({'error': 'History needs a database; install SQLAlchemy'}), 503
+    limit = _page_size()
+    sess = DB_Session()
+    try:
+        q = _history_filters(sess.query(TTSLog))
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                created_at, last_id = _decode_cursor(cursor)
+                created_at = datetime.fromisoformat(created_at)
+            except Exception:
+                return jsonify({'error': 'invalid cursor'}), 400
+            q = q.filter(or_(TTSLog.created_at < created_at,
+                             and_(TTSLog.created_at == created_at, TTSLog.id < last_id)))
+        rows = q.order_by(TTSLog.created_at.desc(), TTSLog.id.desc()).limit(limit + 1).all()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at.isoformat(), rows[-1].id) if more else None
+        return jsonify({'items': [_history_json(r) for r in rows], 'next_cursor': next_cursor})
+    finally:
+        sess.close()
+
+
+def _fts5_query(q):
+    # quote every term so user input cannot use FTS syntax; prefix-match each one
+    return ' '.join('"' + term.replace('"', '""') + '"*' for term in q.split())
+
+
+@app.route('/history/search', methods=['GET'])
+def history_search():
+    """Full-text search over typed and OCR text, newest first, paged by id."""
+    if not SQLALCHEMY_AVAILABLE:
+        return jsonify({'error': 'History needs a database; install SQLAlchemy'}), 503
+    q_text = (request.args.get('q') or '').strip()
+    if not q_text:
+        return jsonify({'error': "Missing 'q' query parameter"}), 400
+    limit = _page_size()
+    sess = DB_Session()
+    try:
+        q = _history_filters(sess.query(TTSLog))
+        if HISTORY_SEARCH == 'fts5':
+            match = sql_text("tts_logs.id IN (SELECT rowid FROM tts_logs_fts WHERE tts_logs_fts MATCH :m)")
+            q = q.filter(match).params(m=_fts5_query(q_text))
+        elif HISTORY_SEARCH == 'postgres':
+            match = sql_text(f"{_PG_TSVECTOR} @@ plainto_tsquery('simple', :m)")
+            if HISTORY_TRIGRAM and len(q_text) >= HISTORY_SUBSTRING_MIN_CHARS:
+                like = f"%{q_text}%"
+                match = or_(match, TTSLog.typed_text.ilike(like), TTSLog.ocr_text.ilike(like))
+            q = q.filter(match).params(m=q_text)
+        else:
+            like = f"%{q_text}%"
+            q = q.filter(or_(TTSLog.typed_text.like(like), TTSLog.ocr_text.like(like)))
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                (last_id,) = _decode_cursor(cursor)
+            except Exception:
+                return jsonify({'error': 'invalid cursor'}), 400
+            q = q.filter(TTSLog.id < last_id)
+        rows = q.order_by(TTSLog.id.desc()).limit(limit + 1).all()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].id) if more else None
+        return jsonify({'items': [_history_json(r) for r in rows], 'next_cursor': next_cursor})
+    finally:
+        sess.close()
+
+
+# --- Retention ---
+# Bounds AUDIO_DIR and UPLOADS_DIR by bytes, age and file count. Each directory
+# keeps an in-memory inventory that is built (and periodically rebuilt) a batch
+# of entries at a time and updated as the server writes files, so no sweep walks
+# a large directory in one go. Files used recently, the latest clips and images of
+# pending jobs are kept. Removed files are dropped from the audio cache index
+# and their tts_logs.audio_filename / image references are nulled.
+# A limit of 0 disables it.
+RETENTION_ENABLED = _parse_bool(os.environ.get('RETENTION_ENABLED', '1'))
+# only log what a sweep would remove
+RETENTION_DRY_RUN = _parse_bool(os.environ.get('RETENTION_DRY_RUN', '0'))
+RETENTION_INTERVAL_SECONDS = float(os.environ.get('RETENTION_INTERVAL_SECONDS', 30))
+RETENTION_RESCAN_SECONDS = float(os.environ.get('RETENTION_RESCAN_SECONDS', 3600))
+RETENTION_SCAN_BATCH = int(os.environ.get('RETENTION_SCAN_BATCH', 500))
+RETENTION_DELETE_BATCH = int(os.environ.get('RETENTION_DELETE_BATCH', 200))
+RETENTION_PROTECT_SECONDS = float(os.environ.get('RETENTION_PROTECT_SECONDS', 600))
+RETENTION_AUDIO_MAX_BYTES = int(os.environ.get('RETENTION_AUDIO_MAX_BYTES', 1024 * 1024 * 1024))
+RETENTION_AUDIO_MAX_AGE_DAYS = float(os.environ.get('RETENTION_AUDIO_MAX_AGE_DAYS', 30))
+RETENTION_AUDIO_MAX_FILES = int(os.environ.get('RETENTION_AUDIO_MAX_FILES', 20000))
+RETENTION_UPLOADS_MAX_BYTES = int(os.environ.get('RETENTION_UPLOADS_MAX_BYTES', 512 * 1024 * 1024))
+RETENTION_UPLOADS_MAX_AGE_DAYS = float(os.environ.get('RETENTION_UPLOADS_MAX_AGE_DAYS', 7))
+RETENTION_UPLOADS_MAX_FILES = int(os.environ.get('RETENTION_UPLOADS_MAX_FILES', 5000))
+
+METRICS.describe('retention_removed_files_total', 'counter', 'Files removed by retention, by directory and reason.')
+METRICS.describe('retention_removed_bytes_total', 'counter', 'Bytes removed by retention, by directory.')
+
+
+class DirectoryRetention:
+    """Inventory and limits for the regular files directly inside one directory."""
+
+    def __init__(self, name, directory, column, max_bytes=0, max_age=0, max_files=0, skip=(), last_used=None):
+        self.name = name
+        self.directory = directory
+        # tts_logs column that stores paths of files in this directory
+        self.column = column
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_files = max_files
+        self.skip = set(skip)
+        # optional callable returning {filename: last use time} for better-than-mtime recency
+        self.last_used = last_used
+        self.total_bytes = 0
+        self.complete = False
+        self.removed_files = 0
+        self.removed_bytes = 0
+        # filename -> (size, mtime)
+        self._files = {}
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._scan = None
+        self._seen = None
+        self._scan_started = 0.0
+        self._scanned_at = 0.0
+        # directory mtime when the last scan started; a change means files came or went
+        self._dir_mtime = None
+        # a refresh scan only stats names the inventory does not hold yet
+        self._refresh = False
+
+    def _set(self, name, size, mtime):
+        old = self._files.get(name)
+        if old:
+            self.total_bytes -= old[0]
+        self._files[name] = (size, mtime)
+        self.total_bytes += size
+
+    def _unset(self, name):
+        old = self._files.pop(name, None)
+        if old:
+            self.total_bytes -= old[0]
+
+    def track(self, path, size=None):
+        """Record a file the server just wrote."""
+        name = os.path.basename(path)
+        if name in self.skip:
+            return
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return
+        with self._lock:
+            self._set(name, size, time.time())
+            if self._seen is not None:
+                self._seen.add(name)
+
+    def untrack(self, paths):
+        with self._lock:
+            for path in paths:
+                self._unset(os.path.basename(path))
+
+    def _directory_mtime(self):
         try:
-            save_tts_log(typed_text=text, audio_filename=filepath, voice=('server_slow' if slow else 'server'), slow=slow)
-        except Exception:
-            pass
+            return os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return None
+
+    def scan_due(self):
+        """True while a scan runs, when a full rescan is due, or when the directory changed.
+
+        Other workers' writes never reach this process's track(), but they do
+        change the directory mtime; that starts a refresh scan which only stats
+        new names and drops vanished ones.
+        """
+        if self._scan is not None:
+            return True
+        if not self.complete or time.monotonic() - self._scanned_at >= RETENTION_RESCAN_SECONDS:
+            self._refresh = False
+            return True
+        if self._directory_mtime() != self._dir_mtime:
+            self._refresh = True
+            return True
+        return False
+
+    def scan_step(self, n=RETENTION_SCAN_BATCH):
+        """Advance the inventory scan by up to `n` entries; True once it finished."""
+        with self._scan_lock:
+            if self._scan is None:
+                self._dir_mtime = self._directory_mtime()
+                self._scan = os.scandir(self.directory)
+                self._scan_started = time.time()
+                with self._lock:
+                    self._seen = set()
+            for _ in range(n):
+                entry = next(self._scan, None)
+                if entry is None:
+                    self._scan.close()
+                    self._scan = None
+                    with self._lock:
+                        # forget files that vanished, but not ones written during the scan
+                        for name in [k for k, (_, mtime) in self._files.items()
+                                     if k not in self._seen and mtime < self._scan_started]:
+                            self._unset(name)
+                        self._seen = None
+                    self.complete = True
+                    self._scanned_at = time.monotonic()
+                    return True
+                if entry.name in self.skip:
+                    continue
+                if self._refresh:
+                    with self._lock:
+                        if entry.name in self._files:
+                            self._seen.add(entry.name)
+                            continue
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                with self._lock:
+                    self._set(entry.name, st.st_size, st.st_mtime)
+                    self._seen.add(entry.name)
+            return False
+
+    def plan(self, protected=(), limit=None, now=None):
+        """Return [(filename, size, reason)] to remove, least recently used first."""
+        now = now or time.time()
+        used = self.last_used() if self.last_used else {}
+        with self._lock:
+            remaining_bytes = self.total_bytes
+            remaining_files = len(self._files)
+            items = [(max(mtime, used.get(name, 0)), name, size) for name, (size, mtime) in self._files.items()]
+        items.sort()
+        victims = []
+        for last, name, size in items:
+            if limit is not None and len(victims) >= limit:
+                break
+            if self.max_age and now - last > self.max_age:
+                reason = 'age'
+            elif self.max_bytes and remaining_bytes > self.max_bytes:
+                reason = 'bytes'
+            elif self.max_files and remaining_files > self.max_files:
+                reason = 'files'
+            else:
+                # everything after this is newer, and the size limits are met
+                break
+            if name in protected or now - last < RETENTION_PROTECT_SECONDS:
+                continue
+            remaining_bytes -= size
+            remaining_files -= 1
+            victims.append((name, size, reason))
+        return victims
+
+    def report(self, protected=()):
+        victims = self.plan(protected)
+        by_reason = {}
+        for _, _, reason in victims:
+            by_reason[reason] = by_reason.get(reason, 0) + 1
+        return dict(self.stats(), would_remove={
+            'files': len(victims),
+            'bytes': sum(size for _, size, _ in victims),
+            'by_reason': by_reason,
+            'sample': [name for name, _, _ in victims[:20]],
+        })
 
-        return send_file(filepath, mimetype="audio/mpeg")
+    def stats(self):
+        with self._lock:
+            files = len(self._files)
+        return {
+            'directory': self.directory,
+            'files': files,
+            'bytes': self.total_bytes,
+            'inventory_complete': self.complete,
+            'max_bytes': self.max_bytes,
+            'max_age_seconds': self.max_age,
+            'max_files': self.max_files,
+            'removed_files': self.removed_files,
+            'removed_bytes': self.removed_bytes,
+        }
 
 
+RETENTION_AUDIO = DirectoryRetention(
+    'audio', AUDIO_DIR, 'audio_filename',
+    max_bytes=RETENTION_AUDIO_MAX_BYTES, max_age=RETENTION_AUDIO_MAX_AGE_DAYS * 86400,
+    max_files=RETENTION_AUDIO_MAX_FILES,
+    skip=('cache_index.json', 'cache_index.json.tmp', 'cache_index.json.lock', '.retention.lock', '.prewarm.lock',
+          'latest.json', 'latest.json.lock'),
+    last_used=AUDIO_CACHE.last_used_times)
+RETENTION_UPLOADS = DirectoryRetention(
+    'uploads', UPLOADS_DIR, 'image',
+    max_bytes=RETENTION_UPLOADS_MAX_BYTES, max_age=RETENTION_UPLOADS_MAX_AGE_DAYS * 86400,
+    max_files=RETENTION_UPLOADS_MAX_FILES)
+RETENTION_DIRS = (RETENTION_AUDIO, RETENTION_UPLOADS)
+
+def _cache_evicted(paths):
+    RETENTION_AUDIO.untrack(paths)
+    # every process clears the references to the clips it evicts itself
+    if not DB_LOG_WRITER.clear_audio_references(paths):
+        _null_references('audio_filename', paths)
+
+
+AUDIO_CACHE.on_store = RETENTION_AUDIO.track
+AUDIO_CACHE.on_remove = _cache_evicted
+
+
+def _retention_protected():
+    protected = {'audio': set(), 'uploads': set()}
+    protected['audio'].update(f"{entry['key']}.mp3" for entry in LATEST.all().values())
+    if SQLALCHEMY_AVAILABLE:
+        sess = DB_Session()
+        try:
+            rows = sess.query(TTSJob.image).filter(TTSJob.status.in_(('queued', 'running')),
+                                                   TTSJob.image.isnot(None)).all()
+            protected['uploads'].update(os.path.basename(r[0]) for r in rows)
+        finally:
+            sess.close()
+    return protected
+
+
+def _null_references(column, paths):
+    """Clear tts_logs references to files that no longer exist."""
+    if not SQLALCHEMY_AVAILABLE or not paths:
+        return 0
+    col = getattr(TTSLog, column)
+    n = 0
+    sess = DB_Session()
+    try:
+        for i in range(0, len(paths), 500):
+            n += sess.query(TTSLog).filter(col.in_(paths[i:i + 500])) \
+                .update({col: None}, synchronize_session=False)
+        sess.commit()
     except Exception as e:
-        print("❌ INTERNAL SERVER ERROR (b64)")
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        sess.rollback()
+        log.error('failed to clear tts_logs file references', extra=_kv(column=column, error=str(e)))
+    finally:
+        sess.close()
+    return n
 
 
-@app.route("/tts_b64_get", methods=["GET"])
-def text_to_speech_b64_get():
+def retention_sweep(dry_run=RETENTION_DRY_RUN):
+    """Remove up to RETENTION_DELETE_BATCH files per directory that exceed the limits."""
+    protected = _retention_protected()
+    for ret in RETENTION_DIRS:
+        victims = ret.plan(protected[ret.name], limit=RETENTION_DELETE_BATCH)
+        if not victims:
+            continue
+        if dry_run:
+            log.info('retention dry run', extra=_kv(directory=ret.name, files=len(victims),
+                                                   bytes=sum(v[1] for v in victims)))
+            continue
+        removed = []
+        for name, size, reason in victims:
+            path = os.path.join(ret.directory, name)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log.warning('retention could not remove file', extra=_kv(path=path, error=str(e)))
+                continue
+            removed.append(path)
+            ret.removed_files += 1
+            ret.removed_bytes += size
+            METRICS.inc('retention_removed_files_total', directory=ret.name, reason=reason)
+            METRICS.inc('retention_removed_bytes_total', size, directory=ret.name)
+        ret.untrack(removed)
+        if ret is RETENTION_AUDIO:
+            AUDIO_CACHE.forget([os.path.basename(p) for p in removed])
+        nulled = _null_references(ret.column, removed)
+        log.info('retention removed files', extra=_kv(directory=ret.name, files=len(removed), log_rows=nulled))
+
+
+# lock file name -> open file holding its lock
+_leader_lock_fh = {}
+
+
+def _host_leader(lock_name):
+    """True in the one process per host that holds AUDIO_DIR/`lock_name` (kept until exit)."""
+    if fcntl is None:
+        return True
+    if lock_name in _leader_lock_fh:
+        return True
+    fh = open(os.path.join(AUDIO_DIR, lock_name), 'a')
     try:
-        b64 = request.args.get("b64")
-        if not b64:
-            return jsonify({"error": "Missing 'b64' query parameter"}), 400
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        return False
+    _leader_lock_fh[lock_name] = fh
+    return True
 
-        # Accept URL-safe base64 as well
+
+def _retention_leader():
+    """Only one process per host sweeps; the others skip until its lock is released."""
+    return _host_leader('.retention.lock')
+
+
+def _retention_loop():
+    while True:
         try:
-            # Normalize padding
-            padding = len(b64) % 4
-            if padding:
-                b64 += "=" * (4 - padding)
-            decoded_bytes = base64.urlsafe_b64decode(b64)
-            text = decoded_bytes.decode("utf-8")
-        except Exception:
-            return jsonify({"error": "Failed to decode base64 query parameter"}), 400
+            if _retention_leader():
+                scanning = [r for r in RETENTION_DIRS if r.scan_due()]
+                if scanning:
+                    for ret in scanning:
+                        ret.scan_step()
+                    # keep scans cheap: short pauses between batches
+                    time.sleep(0.1)
+                    continue
+                retention_sweep()
+        except Exception as e:
+            log.error('retention sweep failed', extra=_kv(error=str(e)))
+        time.sleep(RETENTION_INTERVAL_SECONDS)
 
-        # read slow flag from query
-        slow = _parse_bool(request.args.get('slow'))
-        print("✅ TEXT RECEIVED (from b64 GET):", text, "slow:", slow)
 
-        filename = f"{uuid.uuid4()}.mp3"
-        filepath = os.path.join(AUDIO_DIR, filename)
+@background_service
+def _start_retention():
+    if RETENTION_ENABLED:
+        threading.Thread(target=_retention_loop, daemon=True).start()
 
-        tts = gTTS(text=text, lang="am", slow=slow)
-        tts.save(filepath)
 
-        print("🔊 Audio saved:", filepath)
-        # update latest file
-        global LATEST_FILE
-        LATEST_FILE = filepath
+@app.route('/retention', methods=['GET'])
+def retention_report():
+    """Dry-run report: what a sweep would remove right now, per directory."""
+    protected = _retention_protected()
+    out = {'enabled': RETENTION_ENABLED, 'dry_run': RETENTION_DRY_RUN}
+    for ret in RETENTION_DIRS:
+        # finish (or run) the inventory so the report is exact
+        while not ret.complete or ret._scan is not None:
+            if ret.scan_step():
+                break
+        out[ret.name] = ret.report(protected[ret.name])
+    return jsonify(out)
 
-        return send_file(filepath, mimetype="audio/mpeg")
 
-    except Exception as e:
-        print("❌ INTERNAL SERVER ERROR (b64_get)")
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+# --- Cache prewarming ---
+# One process per host periodically synthesizes the texts most likely to be
+# asked for next that are missing from AUDIO_CACHE: the PREWARM_TOP_N most
+# frequent typed texts of the last PREWARM_WINDOW_DAYS, the PREWARM_RECENT_N
+# most recent ones and every line of PREWARM_PHRASES_FILE ('#' starts a
+# comment). It works through them at PREWARM_RATE clips per second and waits
+# while the host has more than PREWARM_MAX_IN_FLIGHT live requests (summed
+# over the worker processes' METRICS_DIR snapshots; without METRICS_DIR only
+# the prewarming process's own requests are seen). Its segments run on a
+# one-thread pool of their own, so prewarming never holds a SYNTH_POOL worker
+# a live request could be waiting for.
+# prewarm_cache.py runs the same pass from the command line.
+PREWARM_ENABLED = _parse_bool(os.environ.get('PREWARM_ENABLED', '1'))
+PREWARM_INTERVAL_SECONDS = float(os.environ.get('PREWARM_INTERVAL_SECONDS', 3600))
+PREWARM_START_DELAY_SECONDS = float(os.environ.get('PREWARM_START_DELAY_SECONDS', 60))
+PREWARM_TOP_N = int(os.environ.get('PREWARM_TOP_N', 100))
+PREWARM_RECENT_N = int(os.environ.get('PREWARM_RECENT_N', 50))
+PREWARM_WINDOW_DAYS = float(os.environ.get('PREWARM_WINDOW_DAYS', 30))
+PREWARM_PHRASES_FILE = os.environ.get('PREWARM_PHRASES_FILE', '')
+PREWARM_RATE = float(os.environ.get('PREWARM_RATE', 0.5))
+PREWARM_MAX_IN_FLIGHT = int(os.environ.get('PREWARM_MAX_IN_FLIGHT', 0))
+
+METRICS.describe('prewarm_synthesized_total', 'counter', 'Clips synthesized ahead of demand by the prewarmer.')
+METRICS.describe('prewarm_failed_total', 'counter', 'Prewarm syntheses that failed.')
+
+# summary of the last pass, for /stats
+PREWARM_LAST = {}
+
+PREWARM_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prewarm')
+
+
+def read_phrases(path):
+    """Texts listed in a phrase file, one per line."""
+    if not path:
+        return []
+    with open(path, encoding='utf-8') as fh:
+        lines = (line.strip() for line in fh)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+def prewarm_candidates(top_n=PREWARM_TOP_N, recent_n=PREWARM_RECENT_N, window_days=PREWARM_WINDOW_DAYS,
+                       phrases_file=PREWARM_PHRASES_FILE):
+    """(text, slow) pairs to keep cached: most frequent, then most recent, then the phrase file."""
+    out = []
+    if SQLALCHEMY_AVAILABLE and (top_n > 0 or recent_n > 0):
+        sess = DB_Session()
+        try:
+            q = sess.query(TTSLog.typed_text, TTSLog.slow) \
+                .filter(TTSLog.typed_text.isnot(None), TTSLog.typed_text != '')
+            if window_days > 0:
+                q = q.filter(TTSLog.created_at >= datetime.utcnow() - timedelta(days=window_days))
+            q = q.group_by(TTSLog.typed_text, TTSLog.slow)
+            if top_n > 0:
+                out += q.order_by(func.count(TTSLog.id).desc()).limit(top_n).all()
+            if recent_n > 0:
+                out += q.order_by(func.max(TTSLog.created_at).desc()).limit(recent_n).all()
+        finally:
+            sess.close()
+    out += [(text, False) for text in read_phrases(phrases_file)]
+    seen = set()
+    candidates = []
+    for text, slow in out:
+        key = cache_key(text, TTS_LANG, bool(slow))
+        if key not in seen:
+            seen.add(key)
+            candidates.append((text, bool(slow)))
+    return candidates
+
+
+def prewarm(candidates, rate=PREWARM_RATE, max_in_flight=PREWARM_MAX_IN_FLIGHT):
+    """Synthesize the candidates missing from AUDIO_CACHE; returns counts."""
+    counts = {'candidates': len(candidates), 'cached': 0, 'synthesized': 0, 'failed': 0}
+    pause = 1.0 / rate if rate > 0 else 0.0
+    for text, slow in candidates:
+        key = cache_key(text, TTS_LANG, slow)
+        if AUDIO_CACHE.get(key, count=False):
+            counts['cached'] += 1
+            continue
+        # live requests come first
+        while host_in_flight() > max_in_flight:
+            time.sleep(0.5)
+        try:
+            SYNTH_FLIGHTS.do(key, lambda: _synthesize_into_cache(key, text, slow, TTS_LANG, PREWARM_POOL))
+            counts['synthesized'] += 1
+            METRICS.inc('prewarm_synthesized_total')
+        except Exception as e:
+            counts['failed'] += 1
+            METRICS.inc('prewarm_failed_total')
+            log.warning('prewarm failed', extra=_kv(id=key, error=str(e)))
+        time.sleep(pause)
+    return counts
+
+
+def _prewarm_loop():
+    time.sleep(PREWARM_START_DELAY_SECONDS)
+    while True:
+        try:
+            if _host_leader('.prewarm.lock'):
+                t0 = time.time()
+                counts = prewarm(prewarm_candidates())
+                PREWARM_LAST.update(counts, at=t0, seconds=round(time.time() - t0, 1))
+                log.info('prewarm pass done', extra=_kv(**counts))
+        except Exception as e:
+            log.error('prewarm pass failed', extra=_kv(error=str(e)))
+        time.sleep(PREWARM_INTERVAL_SECONDS)
+
+
+@background_service
+def _start_prewarm():
+    if PREWARM_ENABLED:
+        threading.Thread(target=_prewarm_loop, daemon=True).start()
 
 
 if __name__ == "__main__":
@@ -559,14 +4657,10 @@ if __name__ == "__main__":
         mtime = os.path.getmtime(__file__)
     except Exception:
         mtime = None
-    print("🚀 Starting Amharic TTS server...")
-    print("Server file:", __file__, "mtime:", mtime)
-    # print available routes to help debugging 404s
-    try:
-        print("Registered routes:")
-        for rule in app.url_map.iter_rules():
-            methods = ','.join(sorted(rule.methods))
-            print(f"  {rule.rule} -> {methods}")
-    except Exception:
-        pass
+    log.info('starting Amharic TTS server', extra=_kv(file=__file__, mtime=mtime))
+    # log available routes to help debugging 404s
+    for rule in app.url_map.iter_rules():
+        log.debug('route', extra=_kv(rule=rule.rule, methods=','.join(sorted(rule.methods))))
+    start_background_services()
+    # development server; in production run `gunicorn -c gunicorn.conf.py wsgi:app`
     app.run(host="0.0.0.0", port=5001)
@@ -73,10 +73,33 @@
       input.click();
     }
 
+    // Server voices: one request recognizes the image and returns its audio.
+    // Returns false when the browser voice is selected so the caller falls back.
+    async function ocrToSpeech(blob, name){
+      const voice = document.getElementById('voiceSelect')?.value || 'server';
+      if(voice === 'browser') return false;
+      setStatus('Reading and speaking image...', true);
+      try{
+        const fd = new FormData(); fd.append('image', blob, name);
+        if(voice === 'server_slow') fd.append('slow', '1');
+        const res = await fetch(apiUrl('/ocr_tts'), { method: 'POST', body: fd });
+        if(!res.ok){ const j = await res.json().catch(()=>null); setStatus((j && j.text === '') ? 'No text found' : 'OCR error: ' + (j&&j.error?j.error:res.statusText)); return true; }
+        let text = res.headers.get('X-OCR-Text');
+        if(text){
+          try{ text = decodeURIComponent(text); }catch(e){}
+          if(res.headers.get('X-OCR-Text-Truncated')) text += '…';
+          document.getElementById('text').value = text;
+        }
+        await deliverAudio(res);
+      }catch(e){ setStatus('Upload/OCR failed: ' + e); }
+      return true;
+    }
+
     async function uploadFile(file){
-      setStatus('Uploading image for OCR...', true);
       // show preview
       try{ const prev = document.getElementById('preview'); prev.src = URL.createObjectURL(file); prev.style.display = 'block'; }catch(e){}
+      if(await ocrToSpeech(file, file.name || 'capture.jpg')) return;
+      setStatus('Uploading image for OCR...', true);
       try{
         const fd = new FormData(); fd.append('image', file, file.name || 'capture.jpg');
         const res = await fetch(apiUrl('/ocr_upload'), { method: 'POST', body: fd });
@@ -102,6 +125,7 @@
 
       // show preview
       try{ const prev = document.getElementById('preview'); prev.src = URL.createObjectURL(blob); prev.style.display = 'block'; }catch(e){}
+      if(await ocrToSpeech(blob, 'capture.jpg')) return;
 
       setStatus('Uploading image for OCR...', true);
       try{
@@ -134,7 +158,8 @@
     async function sendToESPByPush(ip, blob){ setStatus('Pushing MP3 to ' + ip + '...', true);
       try{ const res = await fetch('http://' + ip + '/play',{method:'POST',headers:{'Content-Type':'audio/mpeg'},body:blob}); if(res.ok){ setStatus('ESP32 accepted audio (push).', false, 'success'); return true; } setStatus('ESP32 push failed: ' + res.status, false, 'error'); return false; }catch(e){ setStatus('ESP32 push error: ' + e, false, 'error'); return false; } }
 
-    async function instructESPtoPull(ip){ setStatus('Instructing ESP32 to fetch latest.mp3...', true); const url = encodeURIComponent(apiUrl('/latest.mp3')); try{ const res = await fetch('http://' + ip + '/play_url?url=' + url); if(res.ok){ setStatus('ESP32 instructed to pull latest.mp3.', false, 'success'); return true } setStatus('ESP32 instruct failed: ' + res.status, false, 'error'); return false; }catch(e){ setStatus('ESP32 instruct error: ' + e, false, 'error'); return false; } }
+    // pull the clip by its stable id when we have one, otherwise whatever is latest
+    async function instructESPtoPull(ip, audioId){ setStatus('Instructing ESP32 to fetch latest.mp3...', true); const url = encodeURIComponent(apiUrl(audioId ? '/audio/' + audioId + '.mp3' : '/latest.mp3')); try{ const res = await fetch('http://' + ip + '/play_url?url=' + url); if(res.ok){ setStatus('ESP32 instructed to pull latest.mp3.', false, 'success'); return true } setStatus('ESP32 instruct failed: ' + res.status, false, 'error'); return false; }catch(e){ setStatus('ESP32 instruct error: ' + e, false, 'error'); return false; } }
 
     // Drag and drop for upload zone
     const uploadZone = document.getElementById('uploadZone');
@@ -294,6 +319,23 @@
 
     function saveSettingsToStorage(obj){ localStorage.setItem(SETTINGS_KEY, JSON.stringify(obj)); }
 
+    // shared settings live on the server; apiBase stays per-browser since it decides which server to ask
+    async function pushSettingsToServer(obj){
+      const shared = Object.assign({}, obj); delete shared.apiBase;
+      try{ await fetch(apiUrl('/settings'), { method: 'PUT', headers: {'Content-Type':'application/json'}, body: JSON.stringify(shared) }); }catch(e){}
+    }
+
+    async function pullSettingsFromServer(){
+      try{
+        const res = await fetch(apiUrl('/settings'));
+        if(!res.ok) return;
+        const data = await res.json();
+        const st = Object.assign(loadSettings(), data.settings || {});
+        saveSettingsToStorage(st);
+        applySettings(st);
+      }catch(e){}
+    }
+
     // range input listeners and +/- buttons in Settings
     try{
       if(s_rate){ s_rate.addEventListener('input', ()=>{ if(s_rate_val) s_rate_val.textContent = parseFloat(s_rate.value).toFixed(1); }); }
@@ -400,13 +442,15 @@
       const obj = { espIp: (s_espIp.value||'').trim(), apiBase: (s_apiBase?.value||'').trim(), voice: s_voiceSelect.value, rate: parseFloat(s_rate.value), pitch: parseFloat(s_pitch.value), volume: parseFloat(s_volume.value), autoplay: !!s_autoplay.checked, themeDark: !!s_themeDark.checked };
       saveSettingsToStorage(obj);
       try{ localStorage.setItem('API_BASE', obj.apiBase || ''); }catch(e){}
+      pushSettingsToServer(obj);
       applySettings(obj);
       setStatus('Settings saved', false, 'success');
       closeSettingsModal();
     });
 
-    // apply settings at startup
+    // apply settings at startup, then refresh them from the server
     applySettings(loadSettings());
+    pullSettingsFromServer();
 
     document.getElementById('convertSend').addEventListener('click', async ()=>{
       const t = document.getElementById('text').value.trim(); if(!t) return alert('Enter text');
@@ -455,19 +499,93 @@
 
       setStatus('Converting...', true);
       const b64 = utf8ToB64(t);
-      try{
-        const res = await fetch('/tts_b64',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({b64, slow})});
-        if(!res.ok){ const j = await res.json().catch(()=>null); setStatus('Convert error: ' + (j&&j.error?j.error:res.statusText)); return; }
-        const blob = await res.blob();
+
+      // No device to push to: stream so playback starts with the first sentence
+      if(!espIp){
         const p = document.getElementById('player');
-        p.src = URL.createObjectURL(blob);
+        const url = apiUrl('/tts_stream?b64=' + encodeURIComponent(b64) + (slow ? '&slow=1' : ''));
         p.volume = uiVolume;
-        try{ p.playbackRate = uiRate; }catch(e){}
-        // only autoplay if user enabled it in Settings
         const shouldAuto = (st && typeof st.autoplay !== 'undefined') ? !!st.autoplay : true;
+        watchPlayback(p);
+        if(url.length > STREAM_URL_MAX){
+          // too long for a request line (gunicorn allows ~4 KB): POST the text instead
+          try{ await streamPost(p, {text: t, slow}, shouldAuto); }catch(e){ setStatus('Error: ' + e); }
+          return;
+        }
+        p.src = url;
+        try{ p.playbackRate = uiRate; }catch(e){}
         if(shouldAuto){ p.play().catch(()=>{}); }
-        try{ await fetch(apiUrl('/latest.mp3')); }catch(e){}
-        if(!espIp){ setStatus('Converted; playing locally.'); return; }
-        if(method === 'push'){ const ok = await sendToESPByPush(espIp, blob); if(!ok){ setStatus('Push failed, trying instruct fallback...'); await instructESPtoPull(espIp); } } else { await instructESPtoPull(espIp); }
+        setStatus('Converted; streaming locally.');
+        return;
+      }
+
+      try{
+        const res = await fetch('/tts_b64',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({b64, slow})});
+        if(!res.ok){ const j = await res.json().catch(()=>null); setStatus('Convert error: ' + (j&&j.error?j.error:res.statusText)); return; }
+        await deliverAudio(res);
       }catch(e){ setStatus('Error: ' + e); }
-    });
\ No newline at end of file
+    });
+
+    // longest /tts_stream GET URL sent; longer texts are POSTed
+    const STREAM_URL_MAX = 3500;
+
+    // report streams the server or the browser could not play
+    function watchPlayback(p){
+      p.onerror = ()=>{
+        if(!p.getAttribute('src')) return;
+        const code = p.error ? p.error.code : 0;
+        setStatus('Playback failed' + (code ? ' (media error ' + code + ')' : '') + '.', false, 'error');
+      };
+    }
+
+    // POST the text to /tts_stream and play the MP3 as it arrives (MediaSource
+    // where the browser can append MP3, otherwise once it has fully arrived)
+    async function streamPost(p, body, autoplay){
+      const res = await fetch(apiUrl('/tts_stream'), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(body)});
+      if(!res.ok){ const j = await res.json().catch(()=>null); setStatus('Convert error: ' + (j&&j.error?j.error:res.statusText)); return; }
+      const uiRate = parseFloat(loadSettings()?.rate ?? 1);
+      if(!(window.MediaSource && MediaSource.isTypeSupported('audio/mpeg') && res.body)){
+        p.src = URL.createObjectURL(await res.blob());
+        try{ p.playbackRate = uiRate; }catch(e){}
+        if(autoplay){ p.play().catch(()=>{}); }
+        setStatus('Audio ready.', false, 'success');
+        return;
+      }
+      const ms = new MediaSource();
+      p.src = URL.createObjectURL(ms);
+      try{ p.playbackRate = uiRate; }catch(e){}
+      await new Promise(resolve => ms.addEventListener('sourceopen', resolve, {once: true}));
+      const sb = ms.addSourceBuffer('audio/mpeg');
+      const appended = ()=> new Promise(resolve => sb.addEventListener('updateend', resolve, {once: true}));
+      const reader = res.body.getReader();
+      let started = false;
+      setStatus('Converted; streaming locally.');
+      for(;;){
+        const {done, value} = await reader.read();
+        if(done) break;
+        sb.appendBuffer(value);
+        await appended();
+        if(!started && autoplay){ started = true; p.play().catch(()=>{}); }
+      }
+      if(ms.readyState === 'open') ms.endOfStream();
+    }
+
+    // play an MP3 response locally and hand it to the ESP32 when one is configured
+    async function deliverAudio(res){
+      const method = document.querySelector('.segmented button.active').dataset.val || 'push';
+      const st = loadSettings();
+      const espIp = (st && st.espIp) ? st.espIp.trim() : '';
+      const uiRate = parseFloat(st?.rate ?? 1);
+      const uiVolume = parseFloat(st?.volume ?? 1);
+      const audioId = res.headers.get('X-Audio-Id');
+      const blob = await res.blob();
+      const p = document.getElementById('player');
+      p.src = URL.createObjectURL(blob);
+      p.volume = uiVolume;
+      try{ p.playbackRate = uiRate; }catch(e){}
+      // only autoplay if user enabled it in Settings
+      const shouldAuto = (st && typeof st.autoplay !== 'undefined') ? !!st.autoplay : true;
+      if(shouldAuto){ p.play().catch(()=>{}); }
+      if(!espIp){ setStatus('Audio ready.', false, 'success'); return; }
+      if(method === 'push'){ const ok = await sendToESPByPush(espIp, blob); if(!ok){ setStatus('Push failed, trying instruct fallback...'); await instructESPtoPull(espIp, audioId); } } else { await instructESPtoPull(espIp, audioId); }
+    }
\ No newline at end of file
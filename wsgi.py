@@ -0,0 +1,9 @@
+"""WSGI entry point for production: `gunicorn -c gunicorn.conf.py wsgi:app`."""
+from pathlib import Path
+
+from create_tables import load_dotenv
+
+# same .env handling as create_tables.py, before server.py reads its settings
+load_dotenv(str(Path(__file__).parent / '.env'))
+
+from server import app, start_background_services  # noqa: E402,F401